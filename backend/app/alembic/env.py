@@ -61,7 +61,7 @@ def process_revision_directives(context, revision, directives):
                     # Update existing rows to set a default value
                     print(column.type)
                     column_default = ''
-                    if str(column.type) in ["INTEGER", "FLOAT"]:
+                    if str(column.type) in ["INTEGER", "BIGINT", "SMALLINT", "FLOAT"]:
                         column_default = 0
                     if str(column.type) in ["BOOLEAN"]:
                         column_default = False
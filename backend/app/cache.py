@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from pydantic import BaseModel
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger("\t  Cache")
+
+Model = TypeVar("Model", BaseModel, bytes)
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    shared_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+@dataclass
+class Fence:
+    """
+    Generation of a key with loads in flight, every eviction of the key bumps it.
+    A load only stores its result when the generation is still the one it started with.
+    """
+    generation: int = 0
+    loads: int = 0
+
+def encode(value: Any) -> bytes:
+    return value if isinstance(value, bytes) else value.model_dump_json().encode()
+
+def decode(raw: bytes, model: type) -> Any:
+    return raw if model is bytes else model.model_validate_json(raw)
+
+class SharedTier:
+    """
+    Cache tier shared by all workers, backed by a Redis compatible server.
+
+    Invalidations are published on `channel`, so every worker can drop the key from its local tier.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: int):
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.channel = f"{namespace}:invalidate"
+        self.ttl = ttl
+        self.listener: Optional[threading.Thread] = None
+        self.pubsub = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(f"{self.namespace}:{key}")
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self.client.set(f"{self.namespace}:{key}", value, ex=max(1, int(self.ttl if ttl is None else ttl)))
+
+    def invalidate(self, *keys: str) -> None:
+        self.client.delete(*(f"{self.namespace}:{key}" for key in keys))
+        for key in keys:
+            self.client.publish(self.channel, key)
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{self.channel: lambda message: callback(message["data"].decode())})
+        self.listener = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self) -> None:
+        if self.listener:
+            self.listener.stop()
+        if self.pubsub:
+            self.pubsub.close()
+        self.client.close()
+
+class TwoTierCache:
+    """
+    Read cache for pydantic models or already encoded `bytes`: a bounded in-process LRU with TTL
+    in front of an optional shared tier.
+
+    Concurrent misses for the same key are coalesced, only the first caller runs the loader
+    and the others wait for its result. A key invalidated while it's being loaded isn't stored,
+    the loaded value may predate the write that invalidated it.
+
+    *Usage*:
+
+    ```python
+    cache = TwoTierCache("activities", max_size=1024, ttl=30, shared_url=CACHE_REDIS_URL)
+
+    page = cache.get_or_load(key, lambda: get_activities_page(db, ...), schemas.ActivityPage)
+    ...
+    cache.invalidate(key)
+    ```
+    """
+
+    def __init__(
+        self, 
+        namespace: str, 
+        max_size: int, 
+        ttl: int, 
+        shared_url: Optional[str] = None, 
+        lifetime: Optional[Callable[[Any], float]] = None
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Seconds a value stays valid, for values that expire on their own. Cached for at most `ttl` either way.
+        self.lifetime = lifetime
+        self.stats = CacheStats()
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.loading: dict[str, threading.Event] = {}
+        self.loading_async: dict[str, asyncio.Future] = {}
+        self.fences: dict[str, Fence] = {}
+        self.lock = threading.Lock()
+        self.shared: Optional[SharedTier] = None
+
+        if shared_url:
+            if redis is None:
+                logger.warning(" CACHE_REDIS_URL is set, but the `redis` package isn't installed, using only the local tier")
+            else:
+                self.shared = SharedTier(shared_url, namespace, ttl)
+
+    def start(self) -> None:
+        """
+        Starts listening for invalidations published by other workers
+        """
+        if self.shared:
+            self.shared.subscribe(self.evict)
+
+    def stop(self) -> None:
+        if self.shared:
+            self.shared.close()
+
+    def get_local(self, key: str) -> tuple[bool, Any]:
+        with self.lock:
+            if (entry := self.entries.get(key)) is None:
+                return False, None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.stats.expirations += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return True, value
+
+    def set_local(self, key: str, value: Any, generation: Optional[int] = None) -> bool:
+        """
+        Stores `value`, unless `key` was evicted since a load got `generation` from `begin_load`
+        """
+        with self.lock:
+            if generation is not None and self.fences[key].generation != generation:
+                return False
+
+            if (ttl := self.ttl_of(value)) <= 0:
+                return False
+
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+            return True
+
+    def evict(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+            if (fence := self.fences.get(key)) is not None:
+                fence.generation += 1
+
+    def ttl_of(self, value: Any) -> float:
+        return self.ttl if self.lifetime is None else min(self.ttl, self.lifetime(value))
+
+    def clear_local(self) -> None:
+        """
+        Evicts every key from the local tier, when invalidations may have been missed
+        """
+        with self.lock:
+            self.entries.clear()
+            for fence in self.fences.values():
+                fence.generation += 1
+
+    def begin_load(self, key: str) -> int:
+        """
+        Registers a load of `key`, returns the generation its result has to be stored with
+        """
+        with self.lock:
+            fence = self.fences.setdefault(key, Fence())
+            fence.loads += 1
+            return fence.generation
+
+    def end_load(self, key: str) -> None:
+        with self.lock:
+            fence = self.fences[key]
+            fence.loads -= 1
+            if not fence.loads:
+                del self.fences[key]
+
+    def is_current(self, key: str, generation: int) -> bool:
+        with self.lock:
+            return self.fences[key].generation == generation
+
+    def share(self, key: str, value: Any, generation: int) -> None:
+        """
+        Stores `value` in the shared tier, unless `key` was evicted since the load started
+        """
+        if not self.is_current(key, generation) or (ttl := self.ttl_of(value)) <= 0:
+            return
+
+        self.shared.set(key, encode(value), ttl)
+        # Evicted while the value was being sent, the invalidation may have reached the shared tier first
+        if not self.is_current(key, generation):
+            self.shared.invalidate(key)
+
+    def count(self, stat: str) -> None:
+        with self.lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Model]], model: type[Model]) -> Optional[Model]:
+        """
+        Returns the cached value of `key`, calling `loader` on a miss. `None` results aren't cached.
+        """
+        while True:
+            found, value = self.get_local(key)
+            if found:
+                return value
+
+            with self.lock:
+                if (pending := self.loading.get(key)) is None:
+                    self.loading[key] = threading.Event()
+                    break
+                self.stats.coalesced += 1
+
+            pending.wait()
+
+        generation = self.begin_load(key)
+        try:
+            if self.shared and (raw := self.shared.get(key)) is not None:
+                self.count("shared_hits")
+                value = decode(raw, model)
+            else:
+                self.count("misses")
+                if (value := loader()) is not None and self.shared:
+                    self.share(key, value, generation)
+
+            if value is not None:
+                self.set_local(key, value, generation)
+
+            return value
+        finally:
+            self.end_load(key)
+            with self.lock:
+                self.loading.pop(key).set()
+
+    async def get_or_load_async(self, key: str, loader: Callable[[], Awaitable[Optional[Model]]], model: type[Model]) -> Optional[Model]:
+        """
+        `get_or_load` for callers running on the event loop.
+
+        Waiting for another coroutine's load with `get_or_load` would block the very loop that load needs,
+        so coalescing here goes through futures. The shared tier is queried from a worker thread.
+        """
+        while True:
+            found, value = self.get_local(key)
+            if found:
+                return value
+
+            if (pending := self.loading_async.get(key)) is None:
+                self.loading_async[key] = asyncio.get_running_loop().create_future()
+                break
+
+            self.count("coalesced")
+            await asyncio.shield(pending)
+
+        generation = self.begin_load(key)
+        try:
+            if self.shared and (raw := await asyncio.to_thread(self.shared.get, key)) is not None:
+                self.count("shared_hits")
+                value = decode(raw, model)
+            else:
+                self.count("misses")
+                if (value := await loader()) is not None and self.shared:
+                    await asyncio.to_thread(self.share, key, value, generation)
+
+            if value is not None:
+                self.set_local(key, value, generation)
+
+            return value
+        finally:
+            self.end_load(key)
+            self.loading_async.pop(key).set_result(None)
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        Drops `keys` from both tiers and tells the other workers to drop them too
+        """
+        if not keys:
+            return
+
+        for key in keys:
+            self.evict(key)
+        with self.lock:
+            self.stats.invalidations += len(keys)
+
+        if self.shared:
+            self.shared.invalidate(*keys)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {**asdict(self.stats), "size": len(self.entries), "max_size": self.max_size}
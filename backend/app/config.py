@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.environ.get("DB_URL")
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DB_URL") # ex. postgresql+asyncpg://..., when set activity routes use the async engine
 CORS_ORIGINS = [
     "http://localhost:3000",
 ]
@@ -14,9 +15,47 @@ IMAGE_URL = "media/uploads/user/"
 
 ACCESS_TOKEN_EXPIRE_TIME = 60 # in minutes
 REFRESH_TOKEN_EXPIRE_TIME = 7
+TOKEN_BLACKLIST_PRUNE_BATCH_SIZE = 5000 # expired tokens deleted per transaction, bounds how long the cleanup holds row locks
 
 ### Hashing
 SECRET_KEY = os.environ.get("SECRET_KEY") # if you don't have one, you can generate one using `openssl rand -hex 32` in cmd
 ENCRYPTION_ALGORITHM = "HS256"
+PASSWORD_HASHING_WORKERS = int(os.environ.get("PASSWORD_HASHING_WORKERS", 2)) # bcrypt processes per server worker
+PASSWORD_HASH_ROUNDS = int(os.environ.get("PASSWORD_HASH_ROUNDS", 12)) # bcrypt cost, `python calibrate.py` picks it for the host
+PASSWORD_HASH_TARGET_MS = 250 # latency budget of a single hash that `calibrate.py` aims for
+PASSWORD_HASHING_MAX_PENDING = 64 # hashes queued or running before logins get 503, bounds the wait to ~max_pending / workers * 0.2s
 
-CHECK_IF_ACTIVE = False
\ No newline at end of file
+CHECK_IF_ACTIVE = False
+
+### Activities
+ACTIVITIES_PAGE_SIZE = 100
+ACTIVITIES_MAX_PAGE_SIZE = 500
+ACTIVITIES_MAX_BATCH_SIZE = 1000
+ACTIVITIES_EXPORT_CHUNK_SIZE = 1000
+ACTIVITIES_IMPORT_CHUNK_SIZE = 10000 # rows per COPY transaction of `loader.py import`
+ACTIVITIES_SEARCH_LIMIT = 20
+ACTIVITIES_CALENDAR_MAX_DAYS = 62 # longest range of `GET /v1/activities/calendar`, a month view with the weeks around it fits
+FAST_SERIALIZATION = os.environ.get("FAST_SERIALIZATION", "").lower() in ("1", "true") # activity list is encoded with orjson, skipping ORM and pydantic
+ACTIVITY_TOMBSTONE_RETENTION = 30 # in days, delta syncs older than this get 410 and have to fetch the whole list again
+
+### Realtime
+ACTIVITY_CHANNEL = "activity_changes" # postgres NOTIFY channel of activity changes
+FEED_MAX_PENDING = 256 # undelivered events per WebSocket before the client is told to resync
+TOKEN_REVOCATION_CHANNEL = "token_revocations" # postgres NOTIFY channel of blacklisted tokens and changed users
+
+### Idempotency
+IDEMPOTENCY_KEY_TTL = 24 # in hours, how long a retry with the same Idempotency-Key gets the original response
+IDEMPOTENCY_CACHE_SIZE = 4096 # recent keys kept in memory by each worker
+
+### Compression
+COMPRESSION_MINIMUM_SIZE = 1024 # in bytes, smaller responses aren't worth the CPU and go out uncompressed
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4 # 0-11, qualities above ~5 cost far more CPU than they save for dynamic responses
+
+### Caching
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL") # optional, shares the activity cache and its invalidations between workers
+ACTIVITY_CACHE_SIZE = 1024 # entries per worker
+ACTIVITY_CACHE_TTL = 30 # in seconds
+VERIFIED_TOKEN_CACHE_SIZE = 4096 # access tokens each worker doesn't verify again until they expire
+USER_CACHE_SIZE = 4096 # users whose authorization data is kept by each worker
+USER_CACHE_TTL = 60 # in seconds, changes made with the app go out immediately, this bounds the ones made directly in the database
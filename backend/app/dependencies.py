@@ -1,18 +1,24 @@
 from typing import Annotated, Literal, Optional, Union
 from typing_extensions import Doc
-from fastapi import Request, Header, Depends, HTTPException, status, Form
+from fastapi import Request, Response, Header, Depends, HTTPException, status, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, OAuth2
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security.utils import get_authorization_scheme_param
+from fastapi.concurrency import run_in_threadpool
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.config import ACCESS_TOKEN_EXPIRE_TIME, SECRET_KEY, ENCRYPTION_ALGORITHM, REFRESH_TOKEN_EXPIRE_TIME, CHECK_IF_ACTIVE
-from uuid import uuid4
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal, AsyncSessionLocal, async_engine
+from app.config import ACCESS_TOKEN_EXPIRE_TIME, SECRET_KEY, ENCRYPTION_ALGORITHM, REFRESH_TOKEN_EXPIRE_TIME, CHECK_IF_ACTIVE, VERIFIED_TOKEN_CACHE_SIZE
+from app.cache import TwoTierCache
+from app.encoding import wants_msgpack
+from uuid import UUID, uuid4
 from pydantic import BaseModel
-from app.domain.user.service import get_user_by_email_and_password, get_user
-from app.domain.token_blacklist.service import create_blacklist_token, get_blacklist_token
+from app.domain.user.service import authenticate_user, authenticate_user_async, get_user_auth, get_user_auth_async, user_cache
+from app.domain.user.schemas import UserAuth
+from app.domain.token_blacklist.service import create_blacklist_token, is_token_revoked, revoked_tokens, token_id
 from app.domain.token_blacklist.schemas import BlacklistTokenElement
+from app.domain.idempotency.schemas import StoredResponse
 from jinja2 import Template
 from functools import wraps
 import jwt
@@ -354,18 +360,42 @@ def DBSessionProvider():
     finally:
         db.close()
 
+async def AsyncDBSessionProvider():
+    """
+    Async counterpart of `DBSessionProvider`, requires `ASYNC_DB_URL` to be set
+
+    *Usage*:
+
+    ```python
+    async def get_activities(
+        ...,
+        db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)]
+    ) -> ActivityPage:
+        ...
+        await db.commit()
+        ...
+    ```
+    """
+
+    async with AsyncSessionLocal() as db:
+        yield db
+
 class EncodedTokens(BaseModel):
     access_token: str | None
     refresh_token: str | None
 
 class AccessToken(BaseModel):
+    jti: UUID
     user_id: int
+    token_version: int = 0 # tokens issued before the claim existed belong to the initial version
     expiration_date: str
     token_type: str
     type: str
 
 class RefreshToken(BaseModel):
+    jti: UUID
     user_id: int
+    token_version: int = 0 # tokens issued before the claim existed belong to the initial version
     expiration_date: str
     token_type: str
     type: str
@@ -395,6 +425,9 @@ class OAuth2PasswordBearerWithCookie(OAuth2):
 
 oauth2_scheme = OAuth2PasswordBearerWithCookie(tokenUrl="oauth2/token", scheme_name="MyOAuth2PasswordRequestForm")
 
+# Access tokens whose signature has been verified, with their parsed expiration date. Tokens don't outlive the TTL
+verified_tokens = TwoTierCache("tokens", VERIFIED_TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_TIME * 60)
+
 def retrieve_tokens(
     token: Annotated[Tokens, Depends(oauth2_scheme)],
     db: Annotated[Session, Depends(DBSessionProvider)]
@@ -412,28 +445,32 @@ def retrieve_tokens(
             detail='Invalid credentials'
         )
     
-    if get_blacklist_token(db, BlacklistTokenElement(token=token.access_token)) or get_blacklist_token(db, BlacklistTokenElement(token=token.access_token)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Blacklisted token'
-        )
-
     decoded_access_token = jwt.decode(token.access_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
     decoded_refresh_token = jwt.decode(token.refresh_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
 
     access_token = AccessToken(
+        jti=token_id(token.access_token, decoded_access_token.get("jti")),
         user_id=decoded_access_token.get("user_id"),
+        token_version=decoded_access_token.get("token_version", 0),
         type=decoded_access_token.get("type"),
         token_type=decoded_access_token.get("token_type"),
         expiration_date=decoded_access_token.get("expiration_date")
     )
     refresh_token = RefreshToken(
+        jti=token_id(token.refresh_token, decoded_refresh_token.get("jti")),
         user_id=decoded_refresh_token.get("user_id"),
+        token_version=decoded_refresh_token.get("token_version", 0),
         type=decoded_refresh_token.get("type"),
         token_type=decoded_refresh_token.get("token_type"),
         expiration_date=decoded_refresh_token.get("expiration_date")
     )
 
+    if is_token_revoked(db, access_token.jti) or is_token_revoked(db, refresh_token.jti):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Blacklisted token'
+        )
+
     if datetime.datetime.now(datetime.UTC) > datetime.datetime.fromisoformat(refresh_token.expiration_date):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -450,27 +487,36 @@ def retrieve_tokens(
 
 
 
-def retrieve_access_token(
-    token: Annotated[Tokens, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(DBSessionProvider)]
-) -> AccessToken:
+def verify_access_token(token: Optional[str]) -> AccessToken:
+    """
+    Decodes the encoded access token and checks its expiration date.
 
-    if not token.access_token:
+    Verified tokens are kept in `verified_tokens` until they expire, a burst of requests with the
+    same cookie checks the signature and parses the claims once.
+    """
+    if not token:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid credentials'
         )
 
-    decoded_access_token = jwt.decode(token.access_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
-
-    access_token = AccessToken(
-        user_id=decoded_access_token.get("user_id"),
-        type=decoded_access_token.get("type"),
-        token_type=decoded_access_token.get("token_type"),
-        expiration_date=decoded_access_token.get("expiration_date")
-    )
+    found, verified = verified_tokens.get_local(token)
+    if not found:
+        decoded_access_token = jwt.decode(token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
+
+        access_token = AccessToken(
+            jti=token_id(token, decoded_access_token.get("jti")),
+            user_id=decoded_access_token.get("user_id"),
+            token_version=decoded_access_token.get("token_version", 0),
+            type=decoded_access_token.get("type"),
+            token_type=decoded_access_token.get("token_type"),
+            expiration_date=decoded_access_token.get("expiration_date")
+        )
+        verified = (access_token, datetime.datetime.fromisoformat(access_token.expiration_date))
+        verified_tokens.set_local(token, verified)
 
-    if datetime.datetime.now(datetime.UTC) > datetime.datetime.fromisoformat(access_token.expiration_date):
+    access_token, expires_at = verified
+    if datetime.datetime.now(datetime.UTC) > expires_at:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Outdated access_token'
@@ -478,6 +524,11 @@ def retrieve_access_token(
 
     return access_token
 
+def retrieve_access_token(
+    token: Annotated[Tokens, Depends(oauth2_scheme)]
+) -> AccessToken:
+    return verify_access_token(token.access_token)
+
 
 
 def retrieve_refresh_token(
@@ -490,16 +541,31 @@ def retrieve_refresh_token(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid credentials'
         )
-    
+
     decoded_refresh_token = jwt.decode(token.refresh_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
 
     refresh_token = RefreshToken(
+        jti=token_id(token.refresh_token, decoded_refresh_token.get("jti")),
         user_id=decoded_refresh_token.get("user_id"),
+        token_version=decoded_refresh_token.get("token_version", 0),
         type=decoded_refresh_token.get("type"),
         token_type=decoded_refresh_token.get("token_type"),
         expiration_date=decoded_refresh_token.get("expiration_date")
     )
 
+    if is_token_revoked(db, refresh_token.jti):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Blacklisted token'
+        )
+
+    # Revoked all at once, by logging out everywhere
+    if not (user := get_user_auth(db, refresh_token.user_id)) or refresh_token.token_version != user.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Blacklisted token'
+        )
+
     if datetime.datetime.now(datetime.UTC) > datetime.datetime.fromisoformat(refresh_token.expiration_date):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -515,16 +581,24 @@ def create_token(
     token_type: str = "Bearer"
 ) -> str:
     item.update({"token_type": token_type})
+    # Blacklisted under this ID, see `token_id`
+    item.setdefault("jti", str(uuid4()))
     return jwt.encode(item, SECRET_KEY, algorithm=ENCRYPTION_ALGORITHM)
 
 
-def ValidateCredentials(
+async def ValidateCredentials(
     form_data: Annotated[MyOAuth2PasswordRequestForm, Depends()],
     db: Annotated[Session, Depends(DBSessionProvider)]
 ) -> EncodedTokens:
 
     # Analyze credentials
-    if not (user := get_user_by_email_and_password(db, form_data.email, form_data.password)):
+    if async_engine is not None:
+        async with AsyncSessionLocal() as async_db:
+            user = await authenticate_user_async(async_db, form_data.email, form_data.password)
+    else:
+        user = await authenticate_user(db, form_data.email, form_data.password)
+
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid credentials'
@@ -541,11 +615,13 @@ def ValidateCredentials(
     try:
         access_token = create_token({
             "user_id": user.id,
+            "token_version": user.token_version,
             "expiration_date": (datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_TIME)).isoformat(),
             "type": "access"
         })
         refresh_token = create_token({
             "user_id": user.id,
+            "token_version": user.token_version,
             "expiration_date": (datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=REFRESH_TOKEN_EXPIRE_TIME)).isoformat(),
             "type": "refresh"
         })
@@ -594,23 +670,51 @@ def CreateRefreshResponses():
         ]
     )
 
-def Authorize(
-    request: Request,
-    access_token: Annotated[AccessToken, Depends(retrieve_access_token)],
-    db: Annotated[Session, Depends(DBSessionProvider)]
+def load_authorization(access_token: AccessToken) -> tuple[bool, Optional[UserAuth]]:
+    with SessionLocal() as db:
+        return is_token_revoked(db, access_token.jti), get_user_auth(db, access_token.user_id)
+
+async def load_authorization_async(access_token: AccessToken) -> tuple[bool, Optional[UserAuth]]:
+    async with AsyncSessionLocal() as db:
+        revoked = access_token.jti in revoked_tokens if revoked_tokens.loaded else await db.run_sync(is_token_revoked, access_token.jti)
+        return revoked, await get_user_auth_async(db, access_token.user_id)
+
+async def Authorize(
+    token: Annotated[EncodedTokens, Depends(oauth2_scheme)]
 ) -> int:
-    if request.cookies.get("access_token"):
-        if get_blacklist_token(db, BlacklistTokenElement(token=request.cookies.get("access_token"))):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail='Blacklisted token'
-            )
+    """
+    The whole authorization of a request in a single async dependency. With warm caches (verified
+    token, revocations, user) it runs on the event loop without any IO, only their misses go to the
+    database, through `ASYNC_DB_URL` when it's set and in the threadpool otherwise.
+    """
+    access_token = verify_access_token(token.access_token)
+
+    found, user = user_cache.get_local(f"user:{access_token.user_id}")
+    if found and revoked_tokens.loaded:
+        revoked = access_token.jti in revoked_tokens
+    elif async_engine is not None:
+        revoked, user = await load_authorization_async(access_token)
+    else:
+        revoked, user = await run_in_threadpool(load_authorization, access_token)
+
+    if revoked:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Blacklisted token'
+        )
     
-    if not (user := get_user(db, access_token.user_id)):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid credentials'
         )
+
+    # Revoked all at once, by logging out everywhere
+    if access_token.token_version != user.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Blacklisted token'
+        )
     
     if CHECK_IF_ACTIVE:
         if not user.is_active:
@@ -623,6 +727,50 @@ def Authorize(
 
 
 
+def etag_matches(
+    request: Request,
+    etag: str
+) -> bool:
+    """
+    Checks whether `etag` satisfies the `If-None-Match` header of the request (weak comparison)
+    """
+    if not (if_none_match := request.headers.get("if-none-match")):
+        return False
+
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def version_etag(
+    request: Request,
+    version: int
+) -> str:
+    """
+    Weak ETag of a response built from the collection `version`. `EncodingMiddleware` sends it as JSON
+    or MessagePack depending on `Accept`, so each representation gets its own tag (sent with `Vary: Accept`).
+    """
+    if wants_msgpack(request.headers.get("accept", "")):
+        return f'W/"{version}-msgpack"'
+    return f'W/"{version}"'
+
+def replay_response(
+    stored: StoredResponse,
+    fingerprint: str
+) -> Response:
+    """
+    Returns the recorded response to a retried request with an `Idempotency-Key`,
+    a key reused for a different request is rejected with 422
+    """
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+            detail="Idempotency-Key was already used for a different request"
+        )
+
+    return Response(stored.body, status_code=stored.status_code, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+
+
 def get_or_create(
     session, 
     model, 
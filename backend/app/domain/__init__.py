@@ -1,3 +1,4 @@
 from app.domain.user import models
 from app.domain.token_blacklist import models
-from app.domain.activity import models
\ No newline at end of file
+from app.domain.activity import models
+from app.domain.idempotency import models
\ No newline at end of file
@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, event, Text, DateTime
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, event, Text, DateTime, Index, BigInteger, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, Session, deferred
 from sqlalchemy.sql import func
 from app.config import IP_ADDRESS
 from ..model_base import Base
@@ -12,6 +13,63 @@ class Activity(Base):
     notes = Column(String)
     date = Column(DateTime, nullable=True)
     done = Column(Boolean)
+    # Version of the collection (`CollectionVersion`) of the last write to the row, `GET /v1/activities/changes` syncs by it
+    revision = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    # 'simple' configuration, because postgres doesn't ship a polish dictionary
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(notes, ''))", persisted=True)
+    ))
+
+    __table_args__ = (
+        # Sort key used by the keyset pagination in `get_activities_page`
+        Index("ix_activities_date_id", "date", "id"),
+        # Serves the `done` filter together with the date range and sort
+        Index("ix_activities_done_date", "done", "date", "id"),
+        # Full text search and its trigram fallback in `search_activities` (requires pg_trgm)
+        Index("ix_activities_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_activities_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+        Index("ix_activities_notes_trgm", "notes", postgresql_using="gin", postgresql_ops={"notes": "gin_trgm_ops"}),
+        Index("ix_activities_revision", "revision"),
+        # Range scans of `get_activity_calendar`, undated activities are left out of the index.
+        # `title` and `notes` stay in the table, unbounded notes would exceed the btree entry size.
+        Index(
+            "ix_activities_calendar_date", "date", "id", 
+            postgresql_where=date.isnot(None), 
+            postgresql_include=["done"]
+        ),
+    )
+
+class ActivityTombstone(Base):
+    """
+    Record of a deleted activity, kept for `ACTIVITY_TOMBSTONE_RETENTION` so delta syncs can pick the deletion up
+    """
+    __tablename__ = "activity_tombstones"
+
+    id = Column(String, primary_key=True)
+    revision = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+
+class ActivityCounter(Base):
+    """
+    Activity counts, `key` is `all` or `day:<YYYY-MM-DD>` of the activity date.
+    Kept up to date by the write paths in the writing transaction and repaired by `reconcile_activity_stats`.
+    """
+    __tablename__ = "activity_counters"
+
+    key = Column(String, primary_key=True)
+    total = Column(BigInteger, nullable=False, default=0)
+    done = Column(BigInteger, nullable=False, default=0)
+
+class CollectionVersion(Base):
+    """
+    Monotonically increasing version of a collection, bumped in the same transaction as every write to it
+    """
+    __tablename__ = "collection_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
 
 
 # [
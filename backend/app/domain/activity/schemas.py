@@ -1,5 +1,8 @@
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, Field
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Annotated, Literal, Union
+from app.config import ACTIVITIES_MAX_BATCH_SIZE
 
 class ActivityBase(BaseModel):
     title: str
@@ -9,4 +12,80 @@ class ActivityBase(BaseModel):
 
 class Activity(ActivityBase):
     id: str
-    
\ No newline at end of file
+
+    class Config:
+        from_attributes = True
+
+@dataclass(slots=True)
+class ActivityRecord:
+    """
+    Plain stand-in for `Activity` on the fast serialization path, fields are in the same order
+    """
+    title: str
+    notes: str
+    date: datetime | None
+    done: bool
+    id: str
+
+class ActivityPage(BaseModel):
+    items: list[Activity]
+    next_cursor: str | None = None
+
+class ActivityFilters(BaseModel):
+    done: bool | None = None
+    date_from: datetime | None = None
+    date_to: datetime | None = None
+    has_date: bool | None = None
+    sort: Literal["date", "-date"] = "date"
+
+class ActivityChanges(BaseModel):
+    changed: list[Activity]
+    deleted: list[str]
+    revision: int
+
+class ActivityCalendarDay(BaseModel):
+    day: date
+    items: list[Activity]
+
+class ActivityCalendar(BaseModel):
+    days: list[ActivityCalendarDay]
+
+class ActivityDayStats(BaseModel):
+    day: date
+    total: int
+    done: int
+
+class ActivityStats(BaseModel):
+    total: int
+    done: int
+    undone: int
+    days: list[ActivityDayStats]
+
+class ActivityPatch(BaseModel):
+    done: bool
+
+class BatchCreate(BaseModel):
+    op: Literal["create"]
+    activity: ActivityBase
+
+class BatchPatch(BaseModel):
+    op: Literal["patch"]
+    id: str
+    patch: ActivityPatch
+
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: str
+
+BatchOperation = Annotated[Union[BatchCreate, BatchPatch, BatchDelete], Field(discriminator="op")]
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(min_length=1, max_length=ACTIVITIES_MAX_BATCH_SIZE)
+
+class BatchResult(BaseModel):
+    op: Literal["create", "patch", "delete"]
+    id: str
+    status: int
+
+class BatchResponse(BaseModel):
+    results: list[BatchResult]
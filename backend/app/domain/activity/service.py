@@ -1,30 +1,910 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import case, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, func, or_, and_, insert, update, delete, select, bindparam, text, literal, cast, true, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY, JSONB, array
+from sqlalchemy.types import Text, BigInteger
 from passlib.context import CryptContext
 from collections import Counter
-from typing import Literal, Optional, List, Tuple
+from typing import Callable, Literal, Optional, List, Tuple, Iterator, Iterable, Sequence, BinaryIO
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+from itertools import batched, groupby
+from app.cache import TwoTierCache
+from app.config import CACHE_REDIS_URL, ACTIVITY_CACHE_SIZE, ACTIVITY_CACHE_TTL, ACTIVITY_CHANNEL, ACTIVITIES_CALENDAR_MAX_DAYS
+from app.domain.idempotency.schemas import StoredResponse
+from app.domain.idempotency.service import record_response, remember_response
 from . import models, schemas
+import asyncio
+import base64
+import csv
+import io
+import json
+import orjson
+
+ACTIVITIES_COLLECTION = "activities"
+# Highest revision of a pruned tombstone, delta syncs from before it can't be served anymore
+TOMBSTONES_HORIZON = "activities:tombstones"
+
+activity_cache = TwoTierCache("activities", ACTIVITY_CACHE_SIZE, ACTIVITY_CACHE_TTL, CACHE_REDIS_URL)
+
+def get_activities_version(db: Session) -> int:
+    """
+    Returns the current version of the activities collection (`0` before the first write)
+    """
+    return db.scalar(
+        select(models.CollectionVersion.version).where(models.CollectionVersion.name == ACTIVITIES_COLLECTION)
+    ) or 0
+
+def bump_activities_version(db: Session) -> int:
+    """
+    Increments the version of the activities collection, has to be called inside the writing transaction.
+
+    The version row stays locked until that transaction ends, so versions are handed out in commit order.
+    """
+    return db.scalar(
+        pg_insert(models.CollectionVersion)
+        .values(name=ACTIVITIES_COLLECTION, version=1)
+        .on_conflict_do_update(
+            index_elements=[models.CollectionVersion.name],
+            set_={"version": models.CollectionVersion.version + 1}
+        )
+        .returning(models.CollectionVersion.version)
+    )
+
+def notify_activity_changes(db: Session, events: List[dict]) -> None:
+    """
+    Publishes `events` on `ACTIVITY_CHANNEL` with a single statement, has to be called inside the writing transaction.
+
+    Postgres delivers them to every `LISTEN`ing worker (`app.realtime.activity_feed`) only once the
+    transaction commits and drops them on rollback. Activities too big for a notification (8000 bytes)
+    are sent without their data, so subscribers fetch them through `GET /v1/activity/{id}`.
+    """
+    payloads = []
+    for event in events:
+        payload = json.dumps(event)
+        if len(payload.encode()) > 7900:
+            payload = json.dumps({key: value for key, value in event.items() if key != "activity"})
+        payloads.append(payload)
+
+    notifications = func.unnest(bindparam("payloads", payloads, type_=ARRAY(Text))).table_valued("payload").render_derived()
+    db.execute(select(func.pg_notify(ACTIVITY_CHANNEL, notifications.c.payload)).select_from(notifications))
+
+def activity_notifications(source, event):
+    """
+    `notify_activity_changes` for events built in SQL, `event` is a `jsonb` expression over the rows of `source`.
+    Returns a single row query, writes embed it as a CTE and have to select from it, Postgres skips unreferenced queries.
+    """
+    payload = case(
+        (func.octet_length(cast(event, Text)) > 7900, event.op("-")(literal("activity", Text))), 
+        else_=event
+    )
+    return select(func.count(func.pg_notify(ACTIVITY_CHANNEL, cast(payload, Text))).label("notified")).select_from(source)
+
+def json_object(**fields):
+    """
+    `jsonb_build_object` of `fields`, keys are typed explicitly so it also works with server-side parameters (asyncpg)
+    """
+    return func.jsonb_build_object(
+        *(argument for key, value in fields.items() for argument in (literal(key, Text), value)), 
+        type_=JSONB
+    )
+
+def activity_counts_upsert(changes):
+    """
+    `count_activities` for changes computed in SQL, `changes` has the `(date, done, sign)` columns.
+    Returns the upsert for writes to embed as a CTE.
+    """
+    keyed = select(
+        func.unnest(array([literal("all", Text), literal("day:", Text) + func.to_char(changes.c.date, "YYYY-MM-DD")])).label("key"),
+        changes.c.done,
+        changes.c.sign
+    ).subquery("keyed")
+    total = func.sum(keyed.c.sign)
+    done = func.sum(case((keyed.c.done, keyed.c.sign), else_=0))
+    deltas = (
+        select(keyed.c.key, total, done)
+        .where(keyed.c.key.isnot(None))
+        .group_by(keyed.c.key)
+        .having(or_(total != 0, done != 0))
+        # Same lock order as `count_activities`
+        .order_by(keyed.c.key)
+    )
+
+    statement = pg_insert(models.ActivityCounter).from_select(["key", "total", "done"], deltas)
+    return statement.on_conflict_do_update(
+        index_elements=[models.ActivityCounter.key],
+        set_={
+            "total": models.ActivityCounter.total + statement.excluded.total, 
+            "done": models.ActivityCounter.done + statement.excluded.done
+        }
+    )
+
+def count_activities(db: Session, changes: Iterable[Tuple[Optional[datetime], bool, int]]) -> None:
+    """
+    Applies `(date, done, sign)` changes to `ActivityCounter` with a single upsert, has to be called inside
+    the writing transaction. `sign` is `1` for an added activity and `-1` for a removed one, a patch is both.
+    """
+    deltas: dict[str, list[int]] = {}
+    for date, done, sign in changes:
+        for key in ("all", f"day:{date.date().isoformat()}") if date else ("all",):
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += sign
+            delta[1] += sign if done else 0
+
+    if not (rows := [
+        {"key": key, "total": total, "done": done} 
+        for key, (total, done) in sorted(deltas.items()) if total or done
+    ]):
+        return
+
+    statement = pg_insert(models.ActivityCounter).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.ActivityCounter.key],
+        set_={
+            "total": models.ActivityCounter.total + statement.excluded.total, 
+            "done": models.ActivityCounter.done + statement.excluded.done
+        }
+    ))
+
+def get_activity_stats(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None) -> schemas.ActivityStats:
+    """
+    Reads the statistics from `ActivityCounter`, a primary key lookup and a range scan over the requested days
+    """
+    query = select(models.ActivityCounter).where(
+        models.ActivityCounter.key.startswith("day:"), 
+        models.ActivityCounter.total > 0
+    )
+    # Keys of days compare as ISO dates
+    if date_from is not None:
+        query = query.where(models.ActivityCounter.key >= f"day:{date_from.isoformat()}")
+    if date_to is not None:
+        query = query.where(models.ActivityCounter.key <= f"day:{date_to.isoformat()}")
+
+    totals = db.get(models.ActivityCounter, "all")
+    total, done = (totals.total, totals.done) if totals else (0, 0)
+
+    return schemas.ActivityStats(
+        total=total,
+        done=done,
+        undone=total - done,
+        days=[
+            schemas.ActivityDayStats(day=date.fromisoformat(counter.key.removeprefix("day:")), total=counter.total, done=counter.done)
+            for counter in db.scalars(query.order_by(models.ActivityCounter.key))
+        ]
+    )
+
+def reconcile_activity_stats(db: Session) -> int:
+    """
+    Recounts the activities and repairs counters that drifted. Returns the number of repaired counters.
+
+    Holds the lock of the collection version while counting, so writes wait instead of racing the recount.
+    """
+    db.execute(
+        select(models.CollectionVersion.version)
+        .where(models.CollectionVersion.name == ACTIVITIES_COLLECTION)
+        .with_for_update()
+    )
+
+    day = func.to_char(models.Activity.date, "YYYY-MM-DD")
+    actual = {
+        key: (total, done or 0)
+        for key, total, done in db.execute(
+            select(func.concat("day:", day), func.count(), func.sum(case((models.Activity.done, 1), else_=0)))
+            .where(models.Activity.date.isnot(None))
+            .group_by(day)
+        )
+    }
+    total, done = db.execute(select(func.count(), func.sum(case((models.Activity.done, 1), else_=0)))).one()
+    actual["all"] = (total, done or 0)
+
+    stored = {counter.key: (counter.total, counter.done) for counter in db.scalars(select(models.ActivityCounter))}
+
+    drifted = [key for key in actual.keys() | stored.keys() if actual.get(key, (0, 0)) != stored.get(key, (0, 0))]
+    if stale := [key for key in stored if key not in actual]:
+        db.execute(delete(models.ActivityCounter).where(models.ActivityCounter.key.in_(stale)))
+    if repaired := [{"key": key, "total": actual[key][0], "done": actual[key][1]} for key in drifted if key in actual]:
+        statement = pg_insert(models.ActivityCounter).values(repaired)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[models.ActivityCounter.key],
+            set_={"total": statement.excluded.total, "done": statement.excluded.done}
+        ))
+
+    db.commit()
+    return len(drifted)
+
+def get_activity_changes(db: Session, since: int) -> Optional[schemas.ActivityChanges]:
+    """
+    Returns activities written and ids of activities deleted after the revision `since`, together with
+    the revision to pass as `since` next time. `since=0` returns every activity, without deletions.
+
+    Returns `None` when the changes can't be computed anymore, because tombstones newer than `since`
+    were already pruned or `since` doesn't come from this database, the client has to fetch the whole list.
+    """
+    # Read before the rows, same as the ETag of the list, so a write committed in between is sent again next time instead of being missed
+    revision = get_activities_version(db)
+    horizon = db.scalar(
+        select(models.CollectionVersion.version).where(models.CollectionVersion.name == TOMBSTONES_HORIZON)
+    ) or 0
+
+    if since == 0:
+        return schemas.ActivityChanges(
+            changed=db.query(models.Activity).order_by(models.Activity.revision, models.Activity.id).all(),
+            deleted=[],
+            revision=revision
+        )
+
+    if since < horizon or since > revision:
+        return None
+
+    # Rows before tombstones, an activity deleted in between then shows up in both and the deletion is applied last
+    changed = (
+        db.query(models.Activity)
+        .filter(models.Activity.revision > since)
+        .order_by(models.Activity.revision, models.Activity.id)
+        .all()
+    )
+    deleted = db.scalars(
+        select(models.ActivityTombstone.id)
+        .where(models.ActivityTombstone.revision > since)
+        .order_by(models.ActivityTombstone.revision, models.ActivityTombstone.id)
+    ).all()
+
+    return schemas.ActivityChanges(changed=changed, deleted=deleted, revision=revision)
+
+def prune_activity_tombstones(db: Session, older_than: datetime) -> int:
+    """
+    Deletes tombstones of activities deleted before `older_than` and moves the sync horizon past them.
+    Returns the number of pruned tombstones.
+    """
+    pruned = db.scalars(
+        delete(models.ActivityTombstone)
+        .where(models.ActivityTombstone.deleted_at < older_than)
+        .returning(models.ActivityTombstone.revision)
+    ).all()
+
+    if pruned:
+        db.execute(
+            pg_insert(models.CollectionVersion)
+            .values(name=TOMBSTONES_HORIZON, version=max(pruned))
+            .on_conflict_do_update(
+                index_elements=[models.CollectionVersion.name],
+                set_={"version": func.greatest(models.CollectionVersion.version, max(pruned))}
+            )
+        )
+
+    db.commit()
+    return len(pruned)
+
+def encode_cursor(act: models.Activity) -> str:
+    """
+    Encodes the `(date, id)` sort key of the last row of a page into an opaque cursor
+    """
+    key = [act.date.isoformat() if act.date else None, act.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    """
+    Reverses `encode_cursor`, raises `ValueError` when the cursor is malformed
+    """
+    try:
+        date, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return (datetime.fromisoformat(date) if date else None), str(id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
 def get_activities_db(db: Session):
     return db.query(models.Activity).all()
 
+def iter_activity_rows(db: Session, chunk_size: int) -> Iterator[Sequence]:
+    """
+    Yields all activities in chunks of `chunk_size` rows of `(id, title, notes, date, done)`.
+
+    Rows are fetched through a server-side cursor, so only a single chunk is held in memory
+    and the first chunk is available before the whole table has been read.
+    """
+    result = db.execute(
+        select(models.Activity.id, models.Activity.title, models.Activity.notes, models.Activity.date, models.Activity.done)
+        .order_by(models.Activity.date.asc().nulls_last(), models.Activity.id.asc())
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def copy_activities_in(db: Session, activities: Iterable[schemas.Activity], chunk_size: int) -> int:
+    """
+    Bulk loads `activities` with `COPY ... FROM STDIN`, one transaction per `chunk_size` rows, so
+    `activities` can be a generator over a file of any size. Returns the number of inserted activities.
+
+    Every chunk is copied into a temporary table first, activities with an existing `id` are skipped
+    instead of failing the whole chunk, so an interrupted load can simply be run again.
+    """
+    inserted = 0
+
+    for chunk in batched(activities, chunk_size):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            (activity.id, activity.title, activity.notes, activity.date.isoformat() if activity.date else "", activity.done)
+            for activity in chunk
+        )
+        buffer.seek(0)
+
+        db.execute(text(
+            "CREATE TEMP TABLE activities_import (id varchar, title varchar, notes varchar, date timestamp, done boolean) ON COMMIT DROP"
+        ))
+        # Unquoted empty fields are NULL in csv, `FORCE_NOT_NULL` keeps empty titles and notes as ''
+        db.connection().connection.cursor().copy_expert(
+            "COPY activities_import (id, title, notes, date, done) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (title, notes))", 
+            buffer
+        )
+        version = bump_activities_version(db)
+        # Re-created activities lose their tombstone, a delta sync would otherwise apply the old deletion after them
+        rows = db.execute(
+            text(
+                "WITH inserted AS ("
+                "INSERT INTO activities (id, title, notes, date, done, revision) "
+                "SELECT id, title, notes, date, done, :revision FROM activities_import "
+                "ON CONFLICT (id) DO NOTHING "
+                "RETURNING id, date, done"
+                "), forgotten AS ("
+                "DELETE FROM activity_tombstones WHERE id IN (SELECT id FROM inserted)"
+                ") "
+                "SELECT date, done FROM inserted"
+            ),
+            {"revision": version}
+        ).all()
+        count_activities(db, ((date, done, 1) for date, done in rows))
+        db.commit()
+        inserted += len(rows)
+
+    return inserted
+
+def copy_activities_out(db: Session, out: BinaryIO, format: Literal["ndjson", "csv"]) -> None:
+    """
+    Writes all activities into `out` with a single `COPY ... TO STDOUT`, in the order of `iter_activity_rows`.
+    Postgres streams the encoded rows, they are never loaded as Python objects.
+    """
+    query = "SELECT id, title, notes, date, done FROM activities ORDER BY date ASC NULLS LAST, id ASC"
+    cursor = db.connection().connection.cursor()
+
+    if format == "csv":
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+        return
+
+    # JSON text never contains raw control characters, with them as the quote and the delimiter
+    # nothing gets quoted and every line is exactly one `row_to_json`
+    cursor.copy_expert(
+        f"COPY (SELECT row_to_json(activity) FROM ({query}) AS activity) TO STDOUT WITH (FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')", 
+        out
+    )
+
+def filter_activities(query, filters: schemas.ActivityFilters):
+    """
+    Applies `filters` to an activity query, every condition is evaluated in SQL
+    """
+    if filters.done is not None:
+        query = query.filter(models.Activity.done == filters.done)
+    if filters.has_date is not None:
+        query = query.filter(models.Activity.date.isnot(None) if filters.has_date else models.Activity.date.is_(None))
+    if filters.date_from is not None:
+        query = query.filter(models.Activity.date >= filters.date_from)
+    if filters.date_to is not None:
+        query = query.filter(models.Activity.date <= filters.date_to)
+    return query
+
+def page_activities(query, limit: int, after: Optional[str], filters: schemas.ActivityFilters):
+    """
+    Narrows an activity query (ORM `Query` or Core `select`) down to a single page matching `filters`,
+    ordered by `(date, id)`. One extra row is fetched to tell whether there is a next page.
+
+    Ascending order puts undated activities last, descending order (`-date`) first,
+    which is exactly the reverse so both directions can walk the same index.
+
+    Pages are addressed by the sort key of the previous page's last row (keyset pagination),
+    so the cost of fetching a page doesn't depend on how deep the client has paged.
+    """
+    query = filter_activities(query, filters)
+    descending = filters.sort == "-date"
+
+    if after:
+        date, id = decode_cursor(after)
+        if descending:
+            if date is None:
+                query = query.filter(or_(
+                    and_(models.Activity.date.is_(None), models.Activity.id < id),
+                    models.Activity.date.isnot(None)
+                ))
+            else:
+                query = query.filter(or_(
+                    models.Activity.date < date,
+                    and_(models.Activity.date == date, models.Activity.id < id)
+                ))
+        else:
+            if date is None:
+                query = query.filter(models.Activity.date.is_(None), models.Activity.id > id)
+            else:
+                query = query.filter(or_(
+                    models.Activity.date > date,
+                    and_(models.Activity.date == date, models.Activity.id > id),
+                    models.Activity.date.is_(None)
+                ))
+
+    if descending:
+        query = query.order_by(models.Activity.date.desc().nulls_first(), models.Activity.id.desc())
+    else:
+        query = query.order_by(models.Activity.date.asc().nulls_last(), models.Activity.id.asc())
+
+    return query.limit(limit + 1)
+
+def get_activities_page(
+    db: Session, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> schemas.ActivityPage:
+    """
+    Returns a single page of activities, see `page_activities`
+    """
+    rows = page_activities(db.query(models.Activity), limit, after, filters).all()
+
+    return schemas.ActivityPage(
+        items=rows[:limit],
+        next_cursor=encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    )
+
+def get_activities_page_json(
+    db: Session, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> bytes:
+    """
+    `get_activities_page` already encoded as JSON, byte for byte what the regular path responds with.
+
+    Selects only the needed columns, maps them to slotted records and encodes those with orjson,
+    skipping ORM identity map bookkeeping and per item pydantic validation.
+    """
+    rows = [
+        schemas.ActivityRecord(title, notes, date, done, id)
+        for id, title, notes, date, done in db.execute(page_activities(
+            select(models.Activity.id, models.Activity.title, models.Activity.notes, models.Activity.date, models.Activity.done),
+            limit, after, filters
+        ))
+    ]
+
+    return orjson.dumps({
+        "items": rows[:limit],
+        "next_cursor": encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    })
+
+def get_activities_page_cached(
+    db: Session, 
+    version: int, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> schemas.ActivityPage:
+    """
+    Cached `get_activities_page`, `version` is the current `get_activities_version`.
+
+    Keys include the version, so any write makes every cached page of the previous version
+    unreachable on all workers, without tracking which pages it affected.
+    """
+    return activity_cache.get_or_load(
+        page_cache_key(version, limit, after, filters), 
+        lambda: get_activities_page(db, limit, after, filters), 
+        schemas.ActivityPage
+    )
+
+def get_activities_page_json_cached(
+    db: Session, 
+    version: int, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> bytes:
+    """
+    Cached `get_activities_page_json`, a hit is served without any encoding at all
+    """
+    return activity_cache.get_or_load(
+        f"json:{page_cache_key(version, limit, after, filters)}", 
+        lambda: get_activities_page_json(db, limit, after, filters), 
+        bytes
+    )
+
+def page_cache_key(version: int, limit: int, after: Optional[str], filters: schemas.ActivityFilters) -> str:
+    return f"page:{version}:{limit}:{after}:{filters.model_dump_json()}"
+
+def get_activity_calendar(db: Session, date_from: date, date_to: date) -> schemas.ActivityCalendar:
+    """
+    Activities dated between `date_from` and `date_to` (both inclusive) grouped by day, days without activities are left out.
+
+    The range condition implies `date IS NOT NULL`, so it's served by a range scan of the partial
+    `ix_activities_calendar_date` index, the rows are then read from the table. Raises `ValueError` for a reversed or too long range.
+    """
+    if date_to < date_from:
+        raise ValueError("`to` is before `from`")
+    if (date_to - date_from).days >= ACTIVITIES_CALENDAR_MAX_DAYS:
+        raise ValueError(f"The range can span at most {ACTIVITIES_CALENDAR_MAX_DAYS} days")
+
+    rows = db.execute(
+        select(models.Activity.id, models.Activity.title, models.Activity.notes, models.Activity.date, models.Activity.done)
+        .where(
+            models.Activity.date >= datetime.combine(date_from, datetime.min.time()),
+            models.Activity.date < datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        )
+        .order_by(models.Activity.date, models.Activity.id)
+    ).mappings()
+
+    return schemas.ActivityCalendar(days=[
+        schemas.ActivityCalendarDay(day=day, items=[schemas.Activity.model_validate(row) for row in items])
+        for day, items in groupby(rows, key=lambda row: row["date"].date())
+    ])
+
+def get_activity_calendar_cached(db: Session, version: int, date_from: date, date_to: date) -> schemas.ActivityCalendar:
+    """
+    Cached `get_activity_calendar`, keyed by the collection version the same way as `get_activities_page_cached`
+    """
+    return activity_cache.get_or_load(
+        f"calendar:{version}:{date_from}:{date_to}",
+        lambda: get_activity_calendar(db, date_from, date_to),
+        schemas.ActivityCalendar
+    )
+
+def search_activities(db: Session, q: str, limit: int) -> List[models.Activity]:
+    """
+    Full text search over title and notes ranked by `ts_rank`.
+
+    When no whole word matches, falls back to trigram word similarity, which also finds
+    prefixes and misspelled words. Both variants are served by GIN indexes.
+    """
+    query = func.websearch_to_tsquery("simple", q)
+
+    if rows := (
+        db.query(models.Activity)
+        .filter(models.Activity.search_vector.op("@@")(query))
+        .order_by(func.ts_rank(models.Activity.search_vector, query).desc(), models.Activity.id)
+        .limit(limit)
+        .all()
+    ):
+        return rows
+
+    return (
+        db.query(models.Activity)
+        .filter(or_(models.Activity.title.op("%>")(q), models.Activity.notes.op("%>")(q)))
+        .order_by(
+            func.greatest(func.word_similarity(q, models.Activity.title), func.word_similarity(q, models.Activity.notes)).desc(), 
+            models.Activity.id
+        )
+        .limit(limit)
+        .all()
+    )
+
 def get_activity(db: Session, act: schemas.Activity):
     return db.query(models.Activity).filter(models.Activity.id == act.id).first()
 
-def create_activity_db(db: Session, act: schemas.Activity):
+def get_activity_cached(db: Session, id: str) -> Optional[schemas.Activity]:
+    """
+    Cached lookup of a single activity, invalidated by every write path that touches it
+    """
+    return activity_cache.get_or_load(f"activity:{id}", lambda: load_activity(db, id), schemas.Activity)
+
+def load_activity(db: Session, id: str) -> Optional[schemas.Activity]:
+    return schemas.Activity.model_validate(activity) if (activity := db.get(models.Activity, id)) else None
+
+def create_activity_db(
+    db: Session, 
+    act: schemas.Activity, 
+    idempotent_response: Optional[StoredResponse] = None, 
+    invalidate: Callable[..., None] = activity_cache.invalidate
+):
+    """
+    Creates the activity, `idempotent_response` is recorded in the same transaction (see `app.domain.idempotency`).
+    `invalidate` receives the cache keys to drop once committed, the write functions below take it as well.
+    """
     db_activity = models.Activity(
         **act.model_dump()
     )
     db.add(db_activity)
+    if idempotent_response is not None:
+        record_response(db, idempotent_response)
+    version = bump_activities_version(db)
+    db_activity.revision = version
+    count_activities(db, [(act.date, act.done, 1)])
+    notify_activity_changes(db, [{"op": "create", "id": act.id, "version": version, "activity": act.model_dump(mode="json")}])
     db.commit()
+    invalidate(f"activity:{db_activity.id}")
+    if idempotent_response is not None:
+        remember_response(idempotent_response)
     db.refresh(db_activity)
     return db_activity
 
-def delete_activity_db(db: Session, act: schemas.Activity):
+def patch_activity_db(
+    db: Session, 
+    id: str, 
+    patch: schemas.ActivityPatch, 
+    invalidate: Callable[..., None] = activity_cache.invalidate
+) -> Optional[schemas.Activity]:
+    """
+    Patches the activity with a single `UPDATE ... RETURNING`, which also updates the counters and
+    publishes the change from its CTEs. Returns `None` when there's no activity with this `id`.
+    """
+    # Locks the version row before the activity, in the same order as every other write, so concurrent writes can't deadlock
+    version = bump_activities_version(db)
+    previous = (
+        select(models.Activity.id, models.Activity.done)
+        .where(models.Activity.id == id)
+        .with_for_update()
+        .subquery("previous")
+    )
+    updated = (
+        update(models.Activity)
+        .where(models.Activity.id == previous.c.id)
+        .values(done=patch.done, revision=version)
+        .returning(
+            models.Activity.id, models.Activity.title, models.Activity.notes, models.Activity.date, models.Activity.done, 
+            previous.c.done.label("previous_done")
+        )
+        .cte("updated")
+    )
+    changes = union_all(
+        select(updated.c.date, updated.c.previous_done.label("done"), literal(-1).label("sign")),
+        select(updated.c.date, updated.c.done, literal(1))
+    ).subquery("changes")
+    counted = activity_counts_upsert(changes).cte("counted")
+    notified = activity_notifications(updated, json_object(
+        op=literal("patch", Text), 
+        id=updated.c.id, 
+        version=literal(version, BigInteger), 
+        activity=json_object(title=updated.c.title, notes=updated.c.notes, date=updated.c.date, done=updated.c.done, id=updated.c.id)
+    )).cte("notified")
+
+    row = db.execute(
+        select(updated.c.id, updated.c.title, updated.c.notes, updated.c.date, updated.c.done)
+        .join_from(updated, notified, true())
+        .add_cte(counted)
+    ).mappings().first()
+
+    if row is None:
+        db.rollback()
+        return None
+
+    db.commit()
+    invalidate(f"activity:{id}")
+    return schemas.Activity.model_validate(row)
+
+def delete_activity_db(db: Session, id: str, invalidate: Callable[..., None] = activity_cache.invalidate) -> bool:
+    """
+    Deletes the activity, records its tombstone, updates the counters and publishes the deletion with a single statement.
+    Returns `False` when there's no activity with this `id`.
+    """
+    # Same lock order as `patch_activity_db`
+    version = bump_activities_version(db)
+    deleted = (
+        delete(models.Activity)
+        .where(models.Activity.id == id)
+        .returning(models.Activity.id, models.Activity.date, models.Activity.done)
+        .cte("deleted")
+    )
+    tombstone = pg_insert(models.ActivityTombstone).from_select(
+        ["id", "revision"], select(deleted.c.id, bindparam("revision", version))
+    )
+    # An id can be deleted again after it was re-created, its tombstone then moves to the new deletion
+    tombstone = (
+        tombstone.on_conflict_do_update(
+            index_elements=[models.ActivityTombstone.id],
+            set_={"revision": tombstone.excluded.revision, "deleted_at": func.now()}
+        )
+        .returning(models.ActivityTombstone.id)
+        .cte("tombstone")
+    )
+    changes = select(deleted.c.date, deleted.c.done, literal(-1).label("sign")).subquery("changes")
+    counted = activity_counts_upsert(changes).cte("counted")
+    notified = activity_notifications(deleted, json_object(
+        op=literal("delete", Text), 
+        id=deleted.c.id, 
+        version=literal(version, BigInteger)
+    )).cte("notified")
+
+    row = db.execute(
+        select(deleted.c.id)
+        .join_from(deleted, tombstone, deleted.c.id == tombstone.c.id)
+        .join(notified, true())
+        .add_cte(counted)
+    ).first()
+
+    if row is None:
+        db.rollback()
+        return False
+
+    db.commit()
+    invalidate(f"activity:{id}")
+    return True
+
+def apply_activity_batch(
+    db: Session, 
+    operations: List[schemas.BatchOperation], 
+    invalidate: Callable[..., None] = activity_cache.invalidate
+) -> List[schemas.BatchResult]:
+    """
+    Applies a list of create / patch / delete operations in a single transaction.
+
+    Operations are grouped into one INSERT, one UPDATE per `done` value and one DELETE
+    instead of a round trip per activity. The outcome of every operation is the same as if
+    they were applied one after another: a patch or a delete of an activity that was
+    deleted earlier in the batch results in 404 and the last patch of an activity wins.
+    """
+    results: List[schemas.BatchResult] = []
+    new_activities = []
+    patched: dict[str, bool] = {}
+    deleted: set[str] = set()
+
+    for operation in operations:
+        if isinstance(operation, schemas.BatchCreate):
+            id = str(uuid4())
+            new_activities.append({**operation.activity.model_dump(), "id": id})
+            results.append(schemas.BatchResult(op=operation.op, id=id, status=201))
+        elif operation.id in deleted:
+            results.append(schemas.BatchResult(op=operation.op, id=operation.id, status=404))
+        elif isinstance(operation, schemas.BatchPatch):
+            patched[operation.id] = operation.patch.done
+            results.append(schemas.BatchResult(op=operation.op, id=operation.id, status=200))
+        else:
+            deleted.add(operation.id)
+            results.append(schemas.BatchResult(op=operation.op, id=operation.id, status=200))
+
+    existing: set[str] = set()
+    patched_rows: dict[str, schemas.Activity] = {}
+    counted: List[Tuple[Optional[datetime], bool, int]] = []
+    deleted_existing: set[str] = set()
+
     try:
-        db.delete(get_activity(db, act))
-        db.commit()
-        return True
-    except Exception as e:
-        print(e)
-        return False
\ No newline at end of file
+        # Bumped upfront, so the written rows and tombstones carry the revision, rolled back below if nothing changed
+        version = bump_activities_version(db)
+
+        if new_activities:
+            db.execute(insert(models.Activity), [{**activity, "revision": version} for activity in new_activities])
+
+        for done in (True, False):
+            if ids := [id for id, value in patched.items() if value is done]:
+                previous = (
+                    select(models.Activity.id, models.Activity.done)
+                    .where(models.Activity.id.in_(ids))
+                    .with_for_update()
+                    .subquery("previous")
+                )
+                for row in db.execute(
+                    update(models.Activity)
+                    .where(models.Activity.id == previous.c.id)
+                    .values(done=done, revision=version)
+                    .returning(
+                        models.Activity.id, models.Activity.title, models.Activity.notes, models.Activity.date, models.Activity.done, 
+                        previous.c.done.label("previous_done")
+                    )
+                    .execution_options(synchronize_session=False)
+                ).mappings():
+                    patched_rows[row["id"]] = schemas.Activity.model_validate(row)
+                    counted.extend([(row["date"], row["previous_done"], -1), (row["date"], row["done"], 1)])
+                    existing.add(row["id"])
+
+        if deleted:
+            for row in db.execute(
+                delete(models.Activity)
+                .where(models.Activity.id.in_(deleted))
+                .returning(models.Activity.id, models.Activity.date, models.Activity.done)
+                .execution_options(synchronize_session=False)
+            ):
+                deleted_existing.add(row.id)
+                counted.append((row.date, row.done, -1))
+            existing.update(deleted_existing)
+
+        if deleted_existing:
+            tombstone = pg_insert(models.ActivityTombstone)
+            db.execute(
+                tombstone.on_conflict_do_update(
+                    index_elements=[models.ActivityTombstone.id],
+                    set_={"revision": tombstone.excluded.revision, "deleted_at": func.now()}
+                ), 
+                [{"id": id, "revision": version} for id in deleted_existing]
+            )
+
+        if not (new_activities or existing):
+            db.rollback()
+        else:
+            count_activities(db, [*((activity["date"], activity["done"], 1) for activity in new_activities), *counted])
+            notify_activity_changes(db, [
+                *(
+                    {"op": "create", "id": activity["id"], "version": version, "activity": schemas.Activity.model_validate(activity).model_dump(mode="json")} 
+                    for activity in new_activities
+                ),
+                *(
+                    {"op": "patch", "id": id, "version": version, "activity": activity.model_dump(mode="json")} 
+                    for id, activity in patched_rows.items() if id not in deleted_existing
+                ),
+                *({"op": "delete", "id": id, "version": version} for id in deleted_existing),
+            ])
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    invalidate(*(f"activity:{id}" for id in existing))
+
+    for result in results:
+        if result.op != "create" and result.status == 200 and result.id not in existing:
+            result.status = 404
+
+    return results
+
+
+
+# Async versions, used by `app/routers/activities_async.py` when `ASYNC_DB_URL` is set.
+#
+# They run the functions above through `AsyncSession.run_sync`, which executes the ORM code
+# on the async connection without blocking the event loop, so both paths share one implementation.
+
+async def get_activities_version_async(db: AsyncSession) -> int:
+    return await db.run_sync(get_activities_version)
+
+async def get_activities_page_cached_async(
+    db: AsyncSession, 
+    version: int, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> schemas.ActivityPage:
+    return await activity_cache.get_or_load_async(
+        page_cache_key(version, limit, after, filters), 
+        lambda: db.run_sync(get_activities_page, limit, after, filters), 
+        schemas.ActivityPage
+    )
+
+async def get_activities_page_json_cached_async(
+    db: AsyncSession, 
+    version: int, 
+    limit: int, 
+    after: Optional[str] = None, 
+    filters: schemas.ActivityFilters = schemas.ActivityFilters()
+) -> bytes:
+    return await activity_cache.get_or_load_async(
+        f"json:{page_cache_key(version, limit, after, filters)}", 
+        lambda: db.run_sync(get_activities_page_json, limit, after, filters), 
+        bytes
+    )
+
+async def get_activity_calendar_cached_async(db: AsyncSession, version: int, date_from: date, date_to: date) -> schemas.ActivityCalendar:
+    return await activity_cache.get_or_load_async(
+        f"calendar:{version}:{date_from}:{date_to}",
+        lambda: db.run_sync(get_activity_calendar, date_from, date_to),
+        schemas.ActivityCalendar
+    )
+
+async def get_activity_cached_async(db: AsyncSession, id: str) -> Optional[schemas.Activity]:
+    return await activity_cache.get_or_load_async(f"activity:{id}", lambda: db.run_sync(load_activity, id), schemas.Activity)
+
+async def search_activities_async(db: AsyncSession, q: str, limit: int) -> List[models.Activity]:
+    return await db.run_sync(search_activities, q, limit)
+
+async def run_write_async(db: AsyncSession, write: Callable, *args):
+    """
+    Runs one of the write functions above, the cache keys it invalidates are dropped afterwards
+    from a worker thread, the shared tier would otherwise be called on the event loop
+    """
+    stale: List[str] = []
+    result = await db.run_sync(write, *args, invalidate=lambda *keys: stale.extend(keys))
+    if stale:
+        await asyncio.to_thread(activity_cache.invalidate, *stale)
+    return result
+
+async def create_activity_db_async(db: AsyncSession, act: schemas.Activity, idempotent_response: Optional[StoredResponse] = None):
+    return await run_write_async(db, create_activity_db, act, idempotent_response)
+
+async def patch_activity_db_async(db: AsyncSession, id: str, patch: schemas.ActivityPatch) -> Optional[schemas.Activity]:
+    return await run_write_async(db, patch_activity_db, id, patch)
+
+async def delete_activity_db_async(db: AsyncSession, id: str) -> bool:
+    return await run_write_async(db, delete_activity_db, id)
+
+async def apply_activity_batch_async(db: AsyncSession, operations: List[schemas.BatchOperation]) -> List[schemas.BatchResult]:
+    return await run_write_async(db, apply_activity_batch, operations)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+from ..model_base import Base
+
+class IdempotencyKey(Base):
+    """
+    Response of a request sent with an `Idempotency-Key` header, replayed when the request is retried
+    """
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    # Hash of the method, path and body, a key reused for a different request is rejected
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now(), index=True)
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+class StoredResponse(BaseModel):
+    key: str
+    fingerprint: str
+    status_code: int
+    body: str
+    # Set once stored, `None` for a response that's being recorded
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
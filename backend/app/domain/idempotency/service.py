@@ -0,0 +1,74 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime, timedelta
+from app.cache import TwoTierCache
+from app.config import CACHE_REDIS_URL, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_KEY_TTL
+from . import models, schemas
+import hashlib
+
+def remaining_lifetime(response: schemas.StoredResponse) -> float:
+    """
+    Seconds until the key of `response` expires, cached responses don't outlive their key
+    """
+    if response.created_at is None:
+        return IDEMPOTENCY_KEY_TTL * 3600
+    return (response.created_at + timedelta(hours=IDEMPOTENCY_KEY_TTL) - datetime.now()).total_seconds()
+
+idempotency_cache = TwoTierCache("idempotency", IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_KEY_TTL * 3600, CACHE_REDIS_URL, remaining_lifetime)
+
+def request_fingerprint(method: str, path: str, body: BaseModel) -> str:
+    return hashlib.sha256(f"{method} {path} {body.model_dump_json()}".encode()).hexdigest()
+
+def get_stored_response(db: Session, key: str) -> Optional[schemas.StoredResponse]:
+    """
+    Returns the response recorded under `key`, served from the cache after the first lookup
+    """
+    return idempotency_cache.get_or_load(key, lambda: load_stored_response(db, key), schemas.StoredResponse)
+
+def load_stored_response(db: Session, key: str) -> Optional[schemas.StoredResponse]:
+    stored = db.get(models.IdempotencyKey, key)
+
+    # Expired keys can linger until the next prune
+    if stored is None or stored.created_at < datetime.now() - timedelta(hours=IDEMPOTENCY_KEY_TTL):
+        return None
+
+    return schemas.StoredResponse.model_validate(stored)
+
+def record_response(db: Session, response: schemas.StoredResponse) -> None:
+    """
+    Adds `response` to the writing transaction, so it's stored only together with the write it describes.
+
+    A concurrent request with the same key fails on the primary key at commit with `IntegrityError`,
+    after which its caller should replay the response of the request that won.
+    """
+    # An expired key can linger until the next prune, it's replaced instead of failing on the primary key.
+    # Executed before the key is added, the autoflush would insert it first.
+    db.execute(
+        delete(models.IdempotencyKey)
+        .where(
+            models.IdempotencyKey.key == response.key, 
+            models.IdempotencyKey.created_at < datetime.now() - timedelta(hours=IDEMPOTENCY_KEY_TTL)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.add(models.IdempotencyKey(**response.model_dump(exclude={"created_at"})))
+
+def remember_response(response: schemas.StoredResponse) -> None:
+    """
+    Caches a response after its transaction committed, so retries hitting this worker skip the database
+    """
+    idempotency_cache.set_local(response.key, response)
+
+def prune_idempotency_keys(db: Session, older_than: datetime) -> int:
+    """
+    Deletes keys recorded before `older_than`. Returns the number of deleted keys.
+    """
+    pruned = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < older_than)).rowcount
+    db.commit()
+    return pruned
+
+async def get_stored_response_async(db: AsyncSession, key: str) -> Optional[schemas.StoredResponse]:
+    return await idempotency_cache.get_or_load_async(key, lambda: db.run_sync(load_stored_response, key), schemas.StoredResponse)
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, event, Text, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, event, Text, DateTime, Uuid
 from sqlalchemy.orm import relationship, Session
 from sqlalchemy.sql import func
 from app.config import IP_ADDRESS
@@ -7,5 +7,6 @@ from ..model_base import Base
 class TokenBlacklist(Base):
     __tablename__ = "token_blacklist"
 
-    token = Column(String, primary_key=True, unique=True)
-    expiration_date = Column(DateTime, nullable=False)
+    # `jti` claim of the token, a fixed-width key instead of the whole encoded JWT
+    id = Column(Uuid, primary_key=True)
+    expiration_date = Column(DateTime, nullable=False, index=True)
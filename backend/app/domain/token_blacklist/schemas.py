@@ -1,8 +1,9 @@
 from pydantic import BaseModel
 from datetime import datetime
+from uuid import UUID
 
 class BlacklistTokenElement(BaseModel):
-    token: str
+    id: UUID
 
 class BlacklistTokenElementFull(BlacklistTokenElement):
     expiration_date: datetime
\ No newline at end of file
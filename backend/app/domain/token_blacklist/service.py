@@ -1,24 +1,85 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import case, func, or_
+from sqlalchemy import case, func, or_, any_, select, delete, inspect, text, bindparam, Connection, Uuid
 from passlib.context import CryptContext
 from collections import Counter
 from typing import Literal, Optional, List, Tuple
+from uuid import UUID, uuid5
+from app.config import TOKEN_REVOCATION_CHANNEL
 from . import models, schemas
+import json
+import threading
 
+# Tokens issued before the `jti` claim are blacklisted under a uuid5 of the encoded token in this namespace
+LEGACY_TOKEN_NAMESPACE = UUID("cc0035cb-eb08-4050-a1ff-17acca3f1b6a")
+
+def token_id(token: str, jti: Optional[str]) -> UUID:
+    """
+    ID `token` is blacklisted under, `jti` is its decoded claim
+    """
+    return UUID(jti) if jti else uuid5(LEGACY_TOKEN_NAMESPACE, token)
+
+class RevokedTokens:
+    """
+    In-memory copy of `token_blacklist`, answers the checks of every authenticated request without a query.
+
+    Loaded at startup, tokens revoked by this worker are added by `create_blacklist_token`, those of
+    other workers arrive through `TOKEN_REVOCATION_CHANNEL`. Until it is loaded, checks fall back to
+    the table (see `is_token_revoked`).
+    """
+
+    def __init__(self):
+        self.ids: set[UUID] = set()
+        self.loaded = False
+        self.lock = threading.Lock()
+        # Held for a whole `load`, the scheduler and `revocation_listener` can reload at the same time
+        self.loading = threading.Lock()
+        # IDs added while `load` queries, the snapshot may not contain them yet
+        self.pending: Optional[set[UUID]] = None
+
+    def load(self, db: Session) -> None:
+        with self.loading:
+            with self.lock:
+                self.pending = set()
+
+            ids = set(db.scalars(select(models.TokenBlacklist.id)))
+
+            with self.lock:
+                self.ids = ids | self.pending
+                self.pending = None
+                self.loaded = True
+
+    def add(self, id: UUID) -> None:
+        with self.lock:
+            self.ids.add(id)
+            if self.pending is not None:
+                self.pending.add(id)
+
+    def __contains__(self, id: UUID) -> bool:
+        return id in self.ids
+
+revoked_tokens = RevokedTokens()
+
+def is_token_revoked(db: Session, id: UUID) -> bool:
+    if revoked_tokens.loaded:
+        return id in revoked_tokens
+    return get_blacklist_token(db, schemas.BlacklistTokenElement(id=id)) is not None
 
 def get_blacklist_token(db: Session, token: schemas.BlacklistTokenElement):
-    return db.query(models.TokenBlacklist).filter(models.TokenBlacklist.token == token.token).first()
+    return db.query(models.TokenBlacklist).filter(models.TokenBlacklist.id == token.id).first()
 
 def get_blacklist_tokens(db: Session):
     return db.query(models.TokenBlacklist).all()
 
 def create_blacklist_token(db: Session, token: schemas.BlacklistTokenElementFull):
     db_blacklist_token = models.TokenBlacklist(
-        token=token.token,
+        id=token.id,
         expiration_date=token.expiration_date
     )
     db.add(db_blacklist_token)
+    # Delivered to the other workers once committed
+    db.execute(select(func.pg_notify(TOKEN_REVOCATION_CHANNEL, json.dumps({"id": str(token.id)}))))
     db.commit()
+    revoked_tokens.add(token.id)
     db.refresh(db_blacklist_token)
     return db_blacklist_token
 
@@ -29,4 +90,48 @@ def delete_blacklist_token(db: Session, token: schemas.BlacklistTokenElement):
         return True
     except Exception as e:
         print(e)
-        return False
\ No newline at end of file
+        return False
+
+def prune_expired_blacklist_tokens(db: Session, batch_size: int) -> int:
+    """
+    Deletes tokens past their expiration date in transactions of at most `batch_size` rows, so the
+    locks are short and the cost follows the number of expired tokens, not the size of the table.
+    Returns the number of deleted tokens.
+    """
+    pruned = 0
+    while True:
+        # Walks `expiration_date` from the oldest token, the array makes the delete probe the primary key instead of joining the table
+        expired = (
+            select(models.TokenBlacklist.id)
+            .where(models.TokenBlacklist.expiration_date < func.now())
+            .order_by(models.TokenBlacklist.expiration_date)
+            .limit(batch_size)
+        )
+        deleted = db.execute(
+            delete(models.TokenBlacklist).where(models.TokenBlacklist.id == any_(func.array(expired.scalar_subquery())))
+        ).rowcount
+        db.commit()
+
+        pruned += deleted
+        if deleted < batch_size:
+            return pruned
+
+def migrate_blacklist_to_token_ids(connection: Connection) -> None:
+    """
+    Rekeys a `token_blacklist` created before the `jti` claim, from the encoded token to its `token_id`.
+    Runs before `create_all`, does nothing on new or already migrated databases.
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table("token_blacklist") or "token" not in {column["name"] for column in inspector.get_columns("token_blacklist")}:
+        return
+
+    tokens = connection.execute(text("SELECT token FROM token_blacklist")).scalars().all()
+
+    connection.execute(text("ALTER TABLE token_blacklist ADD COLUMN id UUID"))
+    if tokens:
+        connection.execute(
+            text("UPDATE token_blacklist SET id = :id WHERE token = :token").bindparams(bindparam("id", type_=Uuid)),
+            [{"id": token_id(token, None), "token": token} for token in tokens]
+        )
+    connection.execute(text("ALTER TABLE token_blacklist DROP COLUMN token"))
+    connection.execute(text("ALTER TABLE token_blacklist ADD PRIMARY KEY (id)"))
@@ -3,5 +3,5 @@ from .models import TokenBlacklist
 
 class TokenBlacklistView(ModelView, model=TokenBlacklist):
     column_list = [
-        'token', 'expiration_date'
+        'id', 'expiration_date'
     ]
@@ -11,5 +11,7 @@ class User(Base):
     email = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=False, nullable=False)
+    # Revocation epoch, embedded in issued tokens; bumping it revokes all of them at once
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
 
 
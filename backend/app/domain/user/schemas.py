@@ -16,4 +16,13 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
-        
+class UserAuth(BaseModel):
+    """
+    What `Authorize` needs to know about a user, cached by `get_user_auth`
+    """
+    id: int
+    is_active: bool
+    token_version: int
+
+    class Config:
+        from_attributes = True
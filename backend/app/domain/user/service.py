@@ -1,21 +1,66 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import case, func, or_
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, or_, select, update, event, Connection
 from collections import Counter
 from typing import Literal, Optional, List, Tuple
+from app.cache import TwoTierCache
+from app.config import CACHE_REDIS_URL, USER_CACHE_SIZE, USER_CACHE_TTL, TOKEN_REVOCATION_CHANNEL, PASSWORD_HASHING_WORKERS, PASSWORD_HASHING_MAX_PENDING, PASSWORD_HASH_ROUNDS
+from app.hashing import PasswordHasher
 from . import models, schemas
+import json
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+password_hasher = PasswordHasher(PASSWORD_HASHING_WORKERS, PASSWORD_HASHING_MAX_PENDING, PASSWORD_HASH_ROUNDS)
+
+user_cache = TwoTierCache("users", USER_CACHE_SIZE, USER_CACHE_TTL, CACHE_REDIS_URL)
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(password, hashed_password)
+    return password_hasher.verify(password, hashed_password)
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+def get_user_auth(db: Session, user_id: int) -> Optional[schemas.UserAuth]:
+    """
+    Cached projection of the user checked on every authenticated request
+    """
+    return user_cache.get_or_load(f"user:{user_id}", lambda: load_user_auth(db, user_id), schemas.UserAuth)
+
+def load_user_auth(db: Session, user_id: int) -> Optional[schemas.UserAuth]:
+    row = db.execute(
+        select(models.User.id, models.User.is_active, models.User.token_version).where(models.User.id == user_id)
+    ).first()
+    return schemas.UserAuth.model_validate(row) if row else None
+
+def notify_user_changed(connection: Connection, user_id: int) -> None:
+    """
+    Has to be called inside the writing transaction, once it commits every worker drops the user
+    from its `user_cache` (see `app.main.apply_revocation`)
+    """
+    connection.execute(select(func.pg_notify(TOKEN_REVOCATION_CHANNEL, json.dumps({"user_id": user_id}))))
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def user_changed(mapper, connection: Connection, target: models.User) -> None:
+    notify_user_changed(connection, target.id)
+    # Dropped before the commit as well, loads of the user that are in flight on other workers
+    # then don't store the old row in the shared tier (see `TwoTierCache`)
+    user_cache.invalidate(f"user:{target.id}")
+    Session.object_session(target).info.setdefault("changed_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session: Session) -> None:
+    # This worker doesn't wait for its own notification
+    for user_id in session.info.pop("changed_users", ()):
+        user_cache.invalidate(f"user:{user_id}")
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_users(session: Session) -> None:
+    session.info.pop("changed_users", None)
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
@@ -24,15 +69,45 @@ def get_user_by_email_and_password(db: Session, email: str, password: str):
 
     if not user: return None
 
-    if verify_password(password, user.hashed_password):
+    verified, new_hash = password_hasher.verify_and_update(password, user.hashed_password)
+    if verified:
+        if new_hash:
+            store_rehashed_password(db, user, new_hash)
         return user
     else: return None
 
+def store_rehashed_password(db: Session, user: models.User, hashed_password: str) -> None:
+    """
+    Replaces a hash with an outdated cost (see `PASSWORD_HASH_ROUNDS`), computed from the password of a successful login
+    """
+    user.hashed_password = hashed_password
+    db.commit()
+
+def revoke_user_tokens(db: Session, user_id: int) -> Optional[int]:
+    """
+    Bumps the user's `token_version`, every token issued before stops being accepted. Returns the new version.
+    """
+    version = db.scalar(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(token_version=models.User.token_version + 1)
+        .returning(models.User.token_version)
+    )
+    # A bulk update, the ORM events of `user_changed` don't see it
+    notify_user_changed(db.connection(), user_id)
+    user_cache.invalidate(f"user:{user_id}")
+    db.commit()
+    user_cache.invalidate(f"user:{user_id}")
+    return version
+
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = hash_password(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: Optional[str] = None):
+    """
+    `hashed_password` can be computed upfront with `password_hasher.hash_async`, otherwise the calling thread waits for it
+    """
+    hashed_password = hashed_password or hash_password(user.password)
     db_user = models.User(
         email=user.email, 
         hashed_password=hashed_password,
@@ -40,4 +115,41 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return db_user
+
+
+async def authenticate_user(db: Session, email: str, password: str):
+    """
+    `get_user_by_email_and_password` for callers on the event loop with a sync session, neither the
+    loop nor a threadpool thread waits for bcrypt
+    """
+    user = await run_in_threadpool(get_user_by_email, db, email)
+
+    if not user: return None
+
+    verified, new_hash = await password_hasher.verify_and_update_async(password, user.hashed_password)
+    if verified:
+        if new_hash:
+            await run_in_threadpool(store_rehashed_password, db, user, new_hash)
+        return user
+    else: return None
+
+
+# Async versions for `AsyncSessionLocal` sessions, the queries are the sync ones run through `run_sync`
+
+async def get_user_auth_async(db: AsyncSession, user_id: int) -> Optional[schemas.UserAuth]:
+    return await user_cache.get_or_load_async(f"user:{user_id}", lambda: db.run_sync(load_user_auth, user_id), schemas.UserAuth)
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    user = await db.run_sync(get_user_by_email, email)
+
+    if not user: return None
+
+    verified, new_hash = await password_hasher.verify_and_update_async(password, user.hashed_password)
+    if verified:
+        if new_hash:
+            # A bulk update, the hash isn't part of `UserAuth` so `user_cache` doesn't need the events of `user_changed`
+            await db.execute(update(models.User).where(models.User.id == user.id).values(hashed_password=new_hash))
+            await db.commit()
+        return user
+    else: return None
@@ -0,0 +1,195 @@
+"""
+Negotiated response encodings.
+
+`EncodingMiddleware` compresses responses with brotli or gzip, whichever the client's
+`Accept-Encoding` prefers, and re-encodes JSON bodies as MessagePack for clients that ask for
+`application/msgpack` in `Accept`. Bodies below the minimum size go out as they are, compressing
+them costs more CPU than it saves on the wire. Streamed bodies (the NDJSON export) are compressed
+chunk by chunk, each chunk is flushed so the client still receives them as they are produced.
+"""
+import gzip
+import zlib
+import orjson
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/msgpack", "application/javascript", "image/svg+xml")
+
+def parse_qvalues(header: str) -> dict[str, float]:
+    """
+    Maps the tokens of an `Accept` / `Accept-Encoding` header to their quality, parameters other than `q` are ignored
+    """
+    qvalues = {}
+    for item in header.split(","):
+        token, *params = [part.strip() for part in item.split(";")]
+        if not token:
+            continue
+
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[token.lower()] = max(q, qvalues.get(token.lower(), 0.0))
+
+    return qvalues
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    The content coding to use for the `Accept-Encoding` header, `None` means identity. On equal quality brotli wins
+    """
+    qvalues = parse_qvalues(accept_encoding)
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+def wants_msgpack(accept: str) -> bool:
+    """
+    Whether the `Accept` header prefers MessagePack over JSON
+    """
+    if msgpack is None:
+        return False
+
+    qvalues = parse_qvalues(accept)
+    msgpack_q = max(qvalues.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+    json_q = qvalues.get("application/json", qvalues.get("application/*", qvalues.get("*/*", 0.0)))
+
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+def compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+class StreamCompressor:
+    """
+    Compresses a streamed body, every chunk is flushed so it can be decoded as soon as it arrives
+    """
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data) + (self.compressor.finish() if last else self.compressor.flush())
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class EncodingMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int, gzip_level: int, brotli_quality: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        responder = EncodingResponder(
+            send,
+            negotiate_encoding(headers.get("accept-encoding", "")),
+            wants_msgpack(headers.get("accept", "")),
+            self
+        )
+        await self.app(scope, receive, responder)
+
+class EncodingResponder:
+    """
+    Re-encodes a single response. Its start message is held back until the first body message
+    shows whether the body is complete (can be measured and converted) or streamed.
+    """
+
+    def __init__(self, send: Send, encoding: Optional[str], to_msgpack: bool, options: EncodingMiddleware):
+        self.send = send
+        self.encoding = encoding
+        self.to_msgpack = to_msgpack
+        self.options = options
+        self.start: Optional[Message] = None
+        self.compressor: Optional[StreamCompressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            return await self.send(message)
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+
+        if self.compressor is not None:
+            body = self.compressor.chunk(body, last=not more_body)
+            return await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        headers = MutableHeaders(raw=self.start["headers"])
+        content_type = headers.get("content-type", "")
+
+        if (
+            "content-encoding" in headers or self.start["status"] in (204, 304)
+            or not (body or more_body) or not is_compressible(content_type)
+        ):
+            self.passthrough = True
+            await self.send(self.start)
+            return await self.send(message)
+
+        headers.add_vary_header("Accept-Encoding")
+
+        if more_body:
+            # Streamed, its size is unknown upfront
+            if self.encoding is not None:
+                self.compressor = StreamCompressor(self.encoding, self.options.gzip_level, self.options.brotli_quality)
+                headers["Content-Encoding"] = self.encoding
+                del headers["Content-Length"]
+                body = self.compressor.chunk(body, last=False)
+            else:
+                self.passthrough = True
+
+            await self.send(self.start)
+            return await self.send({"type": "http.response.body", "body": body, "more_body": True})
+
+        if content_type.startswith("application/json"):
+            # Routes with a per representation ETag already vary on it (see `version_etag`)
+            if "accept" not in (value.strip().lower() for value in headers.get("vary", "").split(",")):
+                headers.add_vary_header("Accept")
+            if self.to_msgpack:
+                body = msgpack.packb(orjson.loads(body))
+                headers["Content-Type"] = "application/msgpack"
+
+        if self.encoding is not None and len(body) >= self.options.minimum_size:
+            body = compress(body, self.encoding, self.options.gzip_level, self.options.brotli_quality)
+            headers["Content-Encoding"] = self.encoding
+
+        headers["Content-Length"] = str(len(body))
+        await self.send(self.start)
+        await self.send({"type": "http.response.body", "body": body})
@@ -0,0 +1,165 @@
+"""
+Password hashing in a bounded process pool.
+
+bcrypt costs ~100-300 ms of CPU per call. Run in the server process it holds a threadpool thread,
+or the event loop itself, for that long and a burst of logins starves every other request. Here
+it runs in `PASSWORD_HASHING_WORKERS` separate processes, so logins scale across cores, and at most
+`PASSWORD_HASHING_MAX_PENDING` calls wait or run at once. Past that `HashingOverloaded` is raised
+and turned into `503 Service Unavailable`, instead of queueing logins that would time out anyway.
+
+Kept free of app imports, the pool processes import this module and nothing else.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+
+logger = logging.getLogger("\t  PasswordHasher")
+
+def password_context(rounds: int) -> CryptContext:
+    """
+    bcrypt with a cost of exactly `rounds`, hashes of any other cost need an update and are rehashed on the next login
+    """
+    # passlib only warns about a cost out of bounds and clamps it, which would rehash every password to the bound
+    if not bcrypt.min_rounds <= rounds <= bcrypt.max_rounds:
+        raise ValueError(f"bcrypt cost has to be between {bcrypt.min_rounds} and {bcrypt.max_rounds}, got {rounds}")
+
+    return CryptContext(
+        schemes=['bcrypt'],
+        deprecated='auto',
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+def configure(rounds: int) -> None:
+    """
+    Initializer of the pool processes
+    """
+    global pwd_context
+    pwd_context = password_context(rounds)
+
+class HashingOverloaded(Exception):
+    pass
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+def verify_and_update_password(password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Returns whether `password` matches and, when the hash has an outdated cost, its new hash
+    """
+    return pwd_context.verify_and_update(password, hashed_password)
+
+class PasswordHasher:
+    """
+    *Usage*:
+
+    ```python
+    hashed_password = password_hasher.hash(password) # from sync code, waits without holding the GIL
+    if await password_hasher.verify_async(password, user.hashed_password):
+        ...
+    ```
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        # Raises for an invalid cost here, instead of in the initializer of every pool process at the first login
+        password_context(rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        with self.lock:
+            self.get_pool()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """
+        The running pool, started if there's none. Has to be called with `lock` held.
+        """
+        if self.pool is None:
+            # spawn, forking a process that already runs threads (scheduler, feeds) isn't safe
+            self.pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=configure,
+                initargs=(self.rounds,)
+            )
+            logger.info(f" Started {self.workers} hashing processes, bcrypt cost {self.rounds}")
+        return self.pool
+
+    def stop(self) -> None:
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def submit(self, function: Callable, *args) -> Future:
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise HashingOverloaded(f"{self.pending} password hashes are already pending")
+            self.pending += 1
+
+        try:
+            future = self.submit_to_pool(function, *args)
+        except BaseException:
+            self.done(None)
+            raise
+
+        future.add_done_callback(self.done)
+        return future
+
+    def submit_to_pool(self, function: Callable, *args) -> Future:
+        """
+        Submits to the running pool, which is started here outside of the app's lifespan, e.g. in scripts.
+        A pool broken by a killed process is replaced and the call retried once.
+        """
+        for attempt in range(2):
+            with self.lock:
+                pool = self.get_pool()
+
+            try:
+                return pool.submit(function, *args)
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                logger.warning(" A hashing process terminated abruptly, restarting the pool")
+                with self.lock:
+                    if self.pool is pool:
+                        self.pool = None
+                pool.shutdown(wait=False)
+
+    def done(self, future: Optional[Future]) -> None:
+        with self.lock:
+            self.pending -= 1
+
+    def hash(self, password: str) -> str:
+        return self.submit(hash_password, password).result()
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return self.submit(verify_password, password, hashed_password).result()
+
+    def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        return self.submit(verify_and_update_password, password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit(hash_password, password))
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self.submit(verify_password, password, hashed_password))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        return await asyncio.wrap_future(self.submit(verify_and_update_password, password, hashed_password))
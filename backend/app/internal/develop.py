@@ -7,6 +7,7 @@ from app.domain.user.models import User
 from app.dependencies import DefaultResponseModel, Authorize, DBSessionProvider, validate_password
 from app.config import SECRET_KEY, ENCRYPTION_ALGORITHM, IP_ADDRESS, IMAGE_DIR, IMAGE_URL
 from app.database import engine
+from app.domain.activity.service import activity_cache
 from pydantic import BaseModel
 from uuid import uuid4
 import subprocess
@@ -167,6 +168,10 @@ async def delete_revision_table(
 #         "message": "Migrated"
 #     }
 
+@router.get("/cache", status_code=status.HTTP_200_OK)
+async def get_cache_stats() -> dict[str, int]:
+    return activity_cache.get_stats()
+
 @router.post("/run-sql")
 async def run_sql_script(
     query: Annotated[str, Form()],
@@ -6,16 +6,26 @@ from fastapi_pagination import add_pagination
 from sqlalchemy import text
 from app.database import engine, SessionLocal
 from app.domain.model_base import Base
-from app.config import CORS_ORIGINS, SECRET_KEY, ENCRYPTION_ALGORITHM, DATABASE_URL
-from app.routers import oauth2, router, user, activities
+from app.config import ACTIVITY_TOMBSTONE_RETENTION, IDEMPOTENCY_KEY_TTL, TOKEN_BLACKLIST_PRUNE_BATCH_SIZE, CORS_ORIGINS, SECRET_KEY, ENCRYPTION_ALGORITHM, DATABASE_URL, ASYNC_DATABASE_URL
+from app.config import COMPRESSION_MINIMUM_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+from app.encoding import EncodingMiddleware
+from app.routers import oauth2, router, user, activities, activities_async
 from app.internal import develop
 from app.internal.admin import create_admin
-from app.domain.token_blacklist.service import get_blacklist_tokens, delete_blacklist_token
+from app.domain.token_blacklist.service import prune_expired_blacklist_tokens, revoked_tokens, migrate_blacklist_to_token_ids
+from app.domain.activity.service import activity_cache, prune_activity_tombstones, reconcile_activity_stats
+from app.domain.idempotency.service import prune_idempotency_keys, idempotency_cache
+from app.domain.user.service import user_cache, password_hasher
+from app.hashing import HashingOverloaded
+from fastapi.responses import JSONResponse
+from app.realtime import activity_feed, revocation_listener
 from contextlib import asynccontextmanager
+from uuid import UUID
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from alembic.config import Config as AlembicConfig
 from alembic import command
+import asyncio
 import datetime
 
 logger = logging.getLogger("\t  Automigrate")
@@ -26,22 +36,75 @@ def remove_expired_blacklisted_tokens():
     # Add your task logic here
     try:
         with SessionLocal() as db:
-            for blacklisted_token in get_blacklist_tokens(db):
-                if blacklisted_token.expiration_date < datetime.datetime.now():
-                    db.delete(blacklisted_token)
-            db.commit()
-        task_logger.info(f" Finished running periodic task {remove_expired_blacklisted_tokens.__name__}()")
+            pruned = prune_expired_blacklist_tokens(db, TOKEN_BLACKLIST_PRUNE_BATCH_SIZE)
+            # Also drops the expired tokens from memory and catches up on missed notifications
+            revoked_tokens.load(db)
+        task_logger.info(f" Finished running periodic task {remove_expired_blacklisted_tokens.__name__}(), pruned {pruned} tokens")
     except Exception as e:
         task_logger.error(f" Error occured while running perodic task {remove_expired_blacklisted_tokens.__name__}(): {e}")
         
 
+def remove_old_activity_tombstones():
+    task_logger.info(f" Executing periodic task {remove_old_activity_tombstones.__name__}() ...")
+    try:
+        with SessionLocal() as db:
+            pruned = prune_activity_tombstones(
+                db, datetime.datetime.now() - datetime.timedelta(days=ACTIVITY_TOMBSTONE_RETENTION)
+            )
+        task_logger.info(f" Finished running periodic task {remove_old_activity_tombstones.__name__}(), pruned {pruned} tombstones")
+    except Exception as e:
+        task_logger.error(f" Error occured while running perodic task {remove_old_activity_tombstones.__name__}(): {e}")
+
+def remove_expired_idempotency_keys():
+    task_logger.info(f" Executing periodic task {remove_expired_idempotency_keys.__name__}() ...")
+    try:
+        with SessionLocal() as db:
+            pruned = prune_idempotency_keys(
+                db, datetime.datetime.now() - datetime.timedelta(hours=IDEMPOTENCY_KEY_TTL)
+            )
+        task_logger.info(f" Finished running periodic task {remove_expired_idempotency_keys.__name__}(), pruned {pruned} keys")
+    except Exception as e:
+        task_logger.error(f" Error occured while running perodic task {remove_expired_idempotency_keys.__name__}(): {e}")
+
+def repair_activity_stats():
+    task_logger.info(f" Executing periodic task {repair_activity_stats.__name__}() ...")
+    try:
+        with SessionLocal() as db:
+            if repaired := reconcile_activity_stats(db):
+                task_logger.warning(f" Repaired {repaired} drifted activity counters")
+        task_logger.info(f" Finished running periodic task {repair_activity_stats.__name__}()")
+    except Exception as e:
+        task_logger.error(f" Error occured while running perodic task {repair_activity_stats.__name__}(): {e}")
+
 def start_scheduler():
     scheduler = BackgroundScheduler()
     scheduler.add_job(remove_expired_blacklisted_tokens, IntervalTrigger(hours=1))
+    scheduler.add_job(remove_old_activity_tombstones, IntervalTrigger(hours=24))
+    scheduler.add_job(remove_expired_idempotency_keys, IntervalTrigger(hours=1))
+    scheduler.add_job(repair_activity_stats, IntervalTrigger(hours=6))
     scheduler.start()
     remove_expired_blacklisted_tokens()
+    # Also fills the counters of activities created before they existed
+    repair_activity_stats()
     return scheduler
 
+def apply_revocation(event: dict) -> None:
+    """
+    A blacklisted token or a changed user of another worker, received by `revocation_listener`
+    """
+    if "user_id" in event:
+        user_cache.evict(f"user:{event['user_id']}")
+    else:
+        revoked_tokens.add(UUID(event["id"]))
+
+def resync_revocations() -> None:
+    """
+    Runs whenever `revocation_listener` (re)connects, catches up on the notifications sent while it wasn't listening
+    """
+    with SessionLocal() as db:
+        revoked_tokens.load(db)
+    user_cache.clear_local()
+
 # Functions
 def check_for_changes(alembic_cfg):
     temp_script_path = "app/alembic/versions/temp_rev_id_temporary_migration.py"
@@ -91,16 +154,36 @@ async def lifespan(app: FastAPI):
             except Exception as e:
                 logger.error(e)
 
+    revocation_listener.start(apply_revocation, resync_revocations)
     scheduler = start_scheduler()
+    activity_cache.start()
+    user_cache.start()
+    idempotency_cache.start()
+    password_hasher.start()
+    # Writes of other workers reach the local cache tier through the feed, even without a shared tier
+    activity_feed.listeners.append(lambda event: activity_cache.evict(f"activity:{event['id']}"))
+    activity_feed.start(asyncio.get_running_loop())
     try:
         yield
     finally:
+        revocation_listener.stop()
+        activity_feed.stop()
+        activity_cache.stop()
+        user_cache.stop()
+        idempotency_cache.stop()
+        password_hasher.stop()
         scheduler.shutdown()
 
 def create_db() -> None:
     """
     Function responsible for creating the database.
     """
+    with engine.begin() as connection:
+        # Trigram indexes on activities need the extension before the tables are created
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+        # Changes the primary key, which the autogenerated migrations can't do with rows in the table
+        migrate_blacklist_to_token_ids(connection)
+
     Base.metadata.create_all(bind=engine)
 
 def get_application() -> FastAPI:
@@ -121,7 +204,20 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    fapp.add_middleware(
+        EncodingMiddleware,
+        minimum_size=COMPRESSION_MINIMUM_SIZE,
+        gzip_level=COMPRESSION_GZIP_LEVEL,
+        brotli_quality=COMPRESSION_BROTLI_QUALITY,
+    )
+
+    @fapp.exception_handler(HashingOverloaded)
+    async def hashing_overloaded(request: Request, exc: HashingOverloaded):
+        # More logins than the hashing processes can take, the client should retry shortly
+        return JSONResponse(status_code=503, content={"detail": "Too many logins, try again later"}, headers={"Retry-After": "1"})
 
+    if ASYNC_DATABASE_URL:
+        fapp.include_router(activities_async.router)
     fapp.include_router(activities.router)
     # fapp.include_router(router)
     # fapp.include_router(oauth2.router)
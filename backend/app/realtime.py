@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Optional
+from fastapi import WebSocket
+from app.database import engine
+from app.config import ACTIVITY_CHANNEL, FEED_MAX_PENDING, TOKEN_REVOCATION_CHANNEL
+
+logger = logging.getLogger("\t  ActivityFeed")
+
+class Subscriber:
+    """
+    Pending events of a single WebSocket connection.
+
+    At most `max_pending` events are kept and events of the same activity are coalesced, only the
+    latest one is delivered. When a consumer falls further behind, its events are dropped and it gets
+    a single `{"op": "resync"}` message instead, telling it to fetch the list again.
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending: OrderedDict[str, dict] = OrderedDict()
+        self.overflowed = False
+        self.ready = asyncio.Event()
+
+    def push(self, event: dict) -> None:
+        if event["id"] in self.pending:
+            self.pending[event["id"]] = event
+            self.pending.move_to_end(event["id"])
+        elif len(self.pending) >= self.max_pending:
+            self.pending.clear()
+            self.overflowed = True
+        else:
+            self.pending[event["id"]] = event
+
+        self.ready.set()
+
+    async def next(self) -> list[dict]:
+        await self.ready.wait()
+        self.ready.clear()
+
+        events = [{"op": "resync"}] if self.overflowed else []
+        events.extend(self.pending.values())
+        self.overflowed = False
+        self.pending.clear()
+
+        return events
+
+    async def forward(self, websocket: WebSocket) -> None:
+        while True:
+            for event in await self.next():
+                await websocket.send_json(event)
+
+class ChannelListener(ABC):
+    """
+    Receives the notifications of a postgres channel in its own thread, on a connection that stays
+    open for the lifetime of the worker. Reconnects after errors, `connected` runs after every
+    successful `LISTEN` and `handle` for every notification, both in the listening thread.
+    """
+
+    def __init__(self, channel: str, thread_name: str):
+        self.channel = channel
+        self.thread_name = thread_name
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.listen, name=self.thread_name, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def connected(self) -> None:
+        pass
+
+    @abstractmethod
+    def handle(self, event: dict) -> None:
+        """
+        Gets the decoded JSON payload of a notification
+        """
+
+    def listen(self) -> None:
+        while not self.stopped.is_set():
+            connection = None
+            try:
+                # Detached from the pool, it stays open for the lifetime of the worker
+                connection = engine.raw_connection()
+                connection.detach()
+                listener = connection.dbapi_connection
+                listener.autocommit = True
+                listener.cursor().execute(f"LISTEN {self.channel};")
+                logger.info(f" Listening on channel {self.channel}")
+                self.connected()
+
+                while not self.stopped.is_set():
+                    if select.select([listener], [], [], 5) == ([], [], []):
+                        continue
+
+                    listener.poll()
+                    while listener.notifies:
+                        notify = listener.notifies.pop(0)
+                        self.handle(json.loads(notify.payload))
+            except Exception as e:
+                logger.error(f" Error occured while listening on channel {self.channel}: {e}, retrying in 3s...")
+                self.stopped.wait(3)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+class ActivityFeed(ChannelListener):
+    """
+    Fans activity changes out to WebSocket subscribers of this worker.
+
+    Writes publish their changes with `pg_notify` (see `notify_activity_changes`), so every worker
+    and host `LISTEN`ing on the channel receives them once they are committed. The listening
+    connection lives in its own thread and hands the events over to the event loop.
+    """
+
+    def __init__(self, channel: str, max_pending: int):
+        super().__init__(channel, "activity-feed")
+        self.max_pending = max_pending
+        self.subscribers: set[Subscriber] = set()
+        self.listeners: list[Callable[[dict], None]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        super().start()
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.max_pending)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def handle(self, event: dict) -> None:
+        self.loop.call_soon_threadsafe(self.publish, event)
+
+    def publish(self, event: dict) -> None:
+        for listener in self.listeners:
+            listener(event)
+        for subscriber in self.subscribers:
+            subscriber.push(event)
+
+class RevocationListener(ChannelListener):
+    """
+    Blacklisted tokens and changed users of other workers (see `revoked_tokens` and `user_cache`).
+
+    Notifications sent while the connection is down are lost, so after every (re)connect `resync`
+    reloads the state they would have updated.
+    """
+
+    def __init__(self, channel: str):
+        super().__init__(channel, "revocation-listener")
+        self.apply: Callable[[dict], None] = lambda event: None
+        self.resync: Callable[[], None] = lambda: None
+
+    def start(self, apply: Callable[[dict], None], resync: Callable[[], None]) -> None:
+        self.apply = apply
+        self.resync = resync
+        super().start()
+
+    def connected(self) -> None:
+        self.resync()
+
+    def handle(self, event: dict) -> None:
+        # Both are thread safe, no need to go through the event loop
+        self.apply(event)
+
+activity_feed = ActivityFeed(ACTIVITY_CHANNEL, FEED_MAX_PENDING)
+revocation_listener = RevocationListener(TOKEN_REVOCATION_CHANNEL)
@@ -1,14 +1,29 @@
-from typing import Annotated, List
-from fastapi import APIRouter, Depends, Request, Response, status, Body, Path, HTTPException
+from typing import Annotated, Any, Awaitable, Callable, List, Literal, Iterator, Optional
+from fastapi import APIRouter, Depends, Request, Response, WebSocket, status, Body, Path, Query, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from app.dependencies import CreateExampleResponse, CreateRefreshResponses, DBSessionProvider, Example, ValidateCredentials, Tokens, EncodedTokens, retrieve_refresh_token, create_token, RefreshToken, DefaultResponseModel, Responses, CreateInternalErrorResponse, CreateAuthResponses
-from app.config import ACCESS_TOKEN_EXPIRE_TIME, ENCRYPTION_ALGORITHM, REFRESH_TOKEN_EXPIRE_TIME, SECRET_KEY
-from app.domain.activity.service import get_activities_db, delete_activity_db, create_activity_db, get_activity
-from app.domain.activity.schemas import Activity, ActivityBase
+from sqlalchemy.exc import IntegrityError
+from app.database import SessionLocal
+from app.realtime import activity_feed
+from app.dependencies import etag_matches, version_etag, replay_response, CreateExampleResponse, CreateRefreshResponses, DBSessionProvider, Example, ValidateCredentials, Tokens, EncodedTokens, retrieve_refresh_token, create_token, RefreshToken, DefaultResponseModel, Responses, CreateInternalErrorResponse, CreateAuthResponses
+from app.config import ACCESS_TOKEN_EXPIRE_TIME, ENCRYPTION_ALGORITHM, REFRESH_TOKEN_EXPIRE_TIME, SECRET_KEY, ACTIVITIES_PAGE_SIZE, ACTIVITIES_MAX_PAGE_SIZE, ACTIVITIES_EXPORT_CHUNK_SIZE, ACTIVITIES_SEARCH_LIMIT, ACTIVITIES_CALENDAR_MAX_DAYS, FAST_SERIALIZATION
+from app.domain.activity.service import get_activities_page_cached, get_activities_page_json_cached, get_activity_cached, delete_activity_db, create_activity_db, patch_activity_db, apply_activity_batch, iter_activity_rows, get_activities_version, search_activities, get_activity_changes, get_activity_stats, get_activity_calendar_cached
+from app.domain.activity.schemas import Activity, ActivityBase, ActivityPage, ActivityCalendar, ActivityChanges, ActivityStats, ActivityFilters, ActivityPatch, BatchRequest, BatchResponse
+from app.domain.idempotency.service import request_fingerprint, get_stored_response
+from app.domain.idempotency.schemas import StoredResponse
 import datetime
 from pydantic import BaseModel
 from uuid import uuid4
+from contextlib import contextmanager
+import asyncio
+import csv
+import io
+import json
 
+# Handlers are sync on purpose, FastAPI runs them in the threadpool, so blocking Session calls don't stall
+# the event loop. With `ASYNC_DB_URL` set, `activities_async.router` takes over the busiest of these routes.
+# `create_activity` is the exception, its flow is shared with that router and sends the queries to the threadpool.
 router = APIRouter(
     prefix="/v1",
     tags=["Activities"],
@@ -17,64 +32,267 @@ router = APIRouter(
     ),
 )
 
+# Handler logic shared with `activities_async.router`, which only swaps the session and the service calls
+
+def ActivityFiltersQuery(
+    done: Annotated[bool | None, Query()] = None,
+    date_from: Annotated[datetime.datetime | None, Query(description="Inclusive lower bound of `date`")] = None,
+    date_to: Annotated[datetime.datetime | None, Query(description="Inclusive upper bound of `date`")] = None,
+    has_date: Annotated[bool | None, Query()] = None,
+    sort: Annotated[Literal["date", "-date"], Query(description="`-date` sorts descending")] = "date"
+) -> ActivityFilters:
+    return ActivityFilters(done=done, date_from=date_from, date_to=date_to, has_date=has_date, sort=sort)
+
+def revalidate(request: Request, response: Response, version: int) -> dict[str, str]:
+    """
+    Sets the headers of a response built from the collection `version` and returns them,
+    raises `304 Not Modified` instead when the client's copy is current
+    """
+    etag = version_etag(request, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+
+    if etag_matches(request, etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return headers
+
+@contextmanager
+def invalid_parameters() -> Iterator[None]:
+    """
+    Turns the `ValueError` of a malformed cursor or range into `400 Bad Request`
+    """
+    try:
+        yield
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+async def create_activity_idempotently(
+    body: ActivityBase,
+    idempotency_key: Optional[str],
+    get_stored: Callable[[str], Awaitable[Optional[StoredResponse]]],
+    create: Callable[[Activity, Optional[StoredResponse]], Awaitable[Any]],
+    rollback: Callable[[], Awaitable[None]]
+) -> DefaultResponseModel | Response:
+    """
+    Creates the activity of `body` or replays the response stored under `idempotency_key`,
+    the callables run the queries on the router's session
+    """
+    fingerprint = request_fingerprint("POST", "/v1/activity", body)
+
+    if idempotency_key and (stored := await get_stored(idempotency_key)) is not None:
+        return replay_response(stored, fingerprint)
+
+    response = DefaultResponseModel(message="Created")
+
+    try:
+        await create(Activity(
+            id=str(uuid4()),
+            title=body.title,
+            date=body.date,
+            done=body.done if body.done else False,
+            notes=body.notes if body.notes else ""
+        ), StoredResponse(
+            key=idempotency_key, 
+            fingerprint=fingerprint, 
+            status_code=status.HTTP_200_OK, 
+            body=response.model_dump_json()
+        ) if idempotency_key else None)
+    except IntegrityError:
+        # A concurrent request with the same key committed first
+        await rollback()
+        if not idempotency_key or (stored := await get_stored(idempotency_key)) is None:
+            raise
+        return replay_response(stored, fingerprint)
+
+    return response
+
 @router.get("/activities")
-async def get_activities(
-    db: Annotated[Session, Depends(DBSessionProvider)]
+def get_activities(
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    filters: Annotated[ActivityFilters, Depends(ActivityFiltersQuery)],
+    limit: Annotated[int, Query(ge=1, le=ACTIVITIES_MAX_PAGE_SIZE)] = ACTIVITIES_PAGE_SIZE,
+    after: Annotated[str | None, Query(description="`next_cursor` returned with the previous page")] = None
+) -> ActivityPage:
+    # The version has to be read before the rows, otherwise a write committed in between
+    # would be served under the newer version and a later revalidation would miss it
+    version = get_activities_version(db)
+    headers = revalidate(request, response, version)
+
+    with invalid_parameters():
+        if FAST_SERIALIZATION:
+            return Response(get_activities_page_json_cached(db, version, limit, after, filters), media_type="application/json", headers=headers)
+
+        return get_activities_page_cached(db, version, limit, after, filters)
+
+@router.get("/activities/calendar")
+def get_calendar(
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    date_from: Annotated[datetime.date, Query(alias="from", description="First day of the view")],
+    date_to: Annotated[datetime.date, Query(alias="to", description=f"Last day of the view, the range spans at most {ACTIVITIES_CALENDAR_MAX_DAYS} days")]
+) -> ActivityCalendar:
+    version = get_activities_version(db)
+    revalidate(request, response, version)
+
+    with invalid_parameters():
+        return get_activity_calendar_cached(db, version, date_from, date_to)
+
+@router.get("/activities/search")
+def search(
+    q: Annotated[str, Query(min_length=1)],
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    limit: Annotated[int, Query(ge=1, le=ACTIVITIES_MAX_PAGE_SIZE)] = ACTIVITIES_SEARCH_LIMIT
 ) -> List[Activity]:
-    return get_activities_db(db)
+    return search_activities(db, q, limit)
 
-@router.post("/activity")
-async def create_activity(
-    body: Annotated[ActivityBase, Body()],
+@router.get("/activities/stats")
+def get_stats(
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    date_from: Annotated[datetime.date | None, Query(description="First day of `days`")] = None,
+    date_to: Annotated[datetime.date | None, Query(description="Last day of `days`")] = None
+) -> ActivityStats:
+    """
+    Totals and per day counts of activities, `days` only lists days with activities
+    """
+    return get_activity_stats(db, date_from, date_to)
+
+@router.get("/activities/changes")
+def get_changes(
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    since: Annotated[int, Query(ge=0, description="`revision` returned by the previous sync, `0` fetches everything")]
+) -> ActivityChanges:
+    if (changes := get_activity_changes(db, since)) is None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE, 
+            detail="Changes since this revision are no longer available, sync again with since=0"
+        )
+
+    return changes
+
+def encode_export(format: Literal["ndjson", "csv"]) -> Iterator[str]:
+    """
+    Streams every activity encoded as NDJSON or CSV, one chunk of rows at a time.
+
+    The session is opened here and not through `DBSessionProvider`,
+    because the dependency is closed before the response body is sent.
+    """
+    columns = ("id", "title", "notes", "date", "done")
+
+    with SessionLocal() as db:
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for rows in iter_activity_rows(db, ACTIVITIES_EXPORT_CHUNK_SIZE):
+                writer.writerows((id, title, notes, date.isoformat() if date else "", done) for id, title, notes, date, done in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in iter_activity_rows(db, ACTIVITIES_EXPORT_CHUNK_SIZE):
+                yield "".join(
+                    json.dumps(dict(zip(columns, (id, title, notes, date.isoformat() if date else None, done))), ensure_ascii=False) + "\n"
+                    for id, title, notes, date, done in rows
+                )
+
+@router.get("/activities/export")
+async def export_activities(
+    format: Annotated[Literal["ndjson", "csv"], Query()] = "ndjson"
+) -> StreamingResponse:
+    return StreamingResponse(
+        encode_export(format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="activities.{format}"'}
+    )
+
+@router.websocket("/activities/ws")
+async def activities_feed(websocket: WebSocket):
+    """
+    Pushes `create`, `patch` and `delete` events of activities, committed by any worker, as JSON messages.
+    A `resync` message means events were dropped because the client couldn't keep up and it should fetch the list again.
+    """
+    await websocket.accept()
+    subscriber = activity_feed.subscribe()
+
+    async def drain():
+        # Nothing is expected from the client, reading only notices the disconnect
+        async for _ in websocket.iter_text():
+            pass
+
+    tasks = [asyncio.create_task(subscriber.forward(websocket)), asyncio.create_task(drain())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        activity_feed.unsubscribe(subscriber)
+
+@router.get("/activity/{id}")
+def get_activity(
+    id: Annotated[str, Path()],
     db: Annotated[Session, Depends(DBSessionProvider)]
-) -> DefaultResponseModel:
+) -> Activity:
 
-    create_activity_db(db, Activity(
-        id=str(uuid4()),
-        title=body.title,
-        date=body.date,
-        done=body.done if body.done else False,
-        notes=body.notes if body.notes else ""
-    ))
+    if (activity := get_activity_cached(db, id)) is None:
+        raise HTTPException(status_code=404)
 
-    return DefaultResponseModel(message="Created")
+    return activity
 
-class PatchBody(BaseModel):
-    done: bool
+@router.post("/activity")
+async def create_activity(
+    body: Annotated[ActivityBase, Body()],
+    db: Annotated[Session, Depends(DBSessionProvider)],
+    idempotency_key: Annotated[str | None, Header(
+        max_length=255, 
+        description="Retries with the same key get the original response instead of creating another activity"
+    )] = None
+) -> DefaultResponseModel:
+    # The session is only used from the threadpool, like in the sync handlers
+    return await create_activity_idempotently(
+        body,
+        idempotency_key,
+        get_stored=lambda key: run_in_threadpool(get_stored_response, db, key),
+        create=lambda activity, stored: run_in_threadpool(create_activity_db, db, activity, stored),
+        rollback=lambda: run_in_threadpool(db.rollback)
+    )
 
 @router.patch("/activity/{id}")
-async def patch_activity(
+def patch_activity(
     id: Annotated[str, Path()],
-    body: Annotated[PatchBody, Body()],
+    body: Annotated[ActivityPatch, Body()],
     db: Annotated[Session, Depends(DBSessionProvider)]
 ) -> DefaultResponseModel:
     
-    activity = get_activity(db, Activity(
-        id=id,
-        notes="",
-        done=False,
-        title=""
-    ))
-
-    if activity is None:
+    if patch_activity_db(db, id, body) is None:
         raise HTTPException(status_code=404)
-    
-    activity.done = body.done
-    db.commit()
 
     return DefaultResponseModel(message="Patched")
 
 @router.delete("/activity/{id}")
-async def delete_activity(
+def delete_activity(
     id: Annotated[str, Path()],
     db: Annotated[Session, Depends(DBSessionProvider)]
 ) -> DefaultResponseModel:
     
-    delete_activity_db(db, Activity(
-        id=id,
-        notes="",
-        done=False,
-        title=""
-    ))
-
-    return DefaultResponseModel(message="Patched")
\ No newline at end of file
+    if not delete_activity_db(db, id):
+        raise HTTPException(status_code=404)
+
+    return DefaultResponseModel(message="Patched")
+
+@router.post("/activities:batch")
+def batch_activities(
+    body: Annotated[BatchRequest, Body()],
+    db: Annotated[Session, Depends(DBSessionProvider)]
+) -> BatchResponse:
+    """
+    Applies mixed create / patch / delete operations in one transaction,
+    `status` of each result is the status code the single operation endpoint would return
+    """
+
+    return BatchResponse(results=apply_activity_batch(db, body.operations))
@@ -0,0 +1,126 @@
+from typing import Annotated, List
+from fastapi import APIRouter, Depends, Request, Response, Body, Path, Query, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.dependencies import AsyncDBSessionProvider, DefaultResponseModel, Responses, CreateInternalErrorResponse
+from app.config import ACTIVITIES_PAGE_SIZE, ACTIVITIES_MAX_PAGE_SIZE, ACTIVITIES_SEARCH_LIMIT, ACTIVITIES_CALENDAR_MAX_DAYS, FAST_SERIALIZATION
+from app.domain.activity.service import (
+    get_activities_version_async, get_activities_page_cached_async, get_activities_page_json_cached_async, get_activity_cached_async, get_activity_calendar_cached_async, search_activities_async,
+    create_activity_db_async, patch_activity_db_async, delete_activity_db_async, apply_activity_batch_async
+)
+from app.domain.activity.schemas import Activity, ActivityBase, ActivityPage, ActivityCalendar, ActivityFilters, ActivityPatch, BatchRequest, BatchResponse
+from app.domain.idempotency.service import get_stored_response_async
+from app.routers.activities import ActivityFiltersQuery, revalidate, invalid_parameters, create_activity_idempotently
+import datetime
+
+# Same routes as `activities.router`, served through the async engine.
+# Included before it when `ASYNC_DB_URL` is set, so these take precedence and the rest falls through.
+router = APIRouter(
+    prefix="/v1",
+    tags=["Activities"],
+    responses=Responses(
+        CreateInternalErrorResponse()
+    ),
+)
+
+@router.get("/activities")
+async def get_activities(
+    request: Request,
+    response: Response,
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)],
+    filters: Annotated[ActivityFilters, Depends(ActivityFiltersQuery)],
+    limit: Annotated[int, Query(ge=1, le=ACTIVITIES_MAX_PAGE_SIZE)] = ACTIVITIES_PAGE_SIZE,
+    after: Annotated[str | None, Query(description="`next_cursor` returned with the previous page")] = None
+) -> ActivityPage:
+    version = await get_activities_version_async(db)
+    headers = revalidate(request, response, version)
+
+    with invalid_parameters():
+        if FAST_SERIALIZATION:
+            return Response(await get_activities_page_json_cached_async(db, version, limit, after, filters), media_type="application/json", headers=headers)
+
+        return await get_activities_page_cached_async(db, version, limit, after, filters)
+
+@router.get("/activities/calendar")
+async def get_calendar(
+    request: Request,
+    response: Response,
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)],
+    date_from: Annotated[datetime.date, Query(alias="from", description="First day of the view")],
+    date_to: Annotated[datetime.date, Query(alias="to", description=f"Last day of the view, the range spans at most {ACTIVITIES_CALENDAR_MAX_DAYS} days")]
+) -> ActivityCalendar:
+    version = await get_activities_version_async(db)
+    revalidate(request, response, version)
+
+    with invalid_parameters():
+        return await get_activity_calendar_cached_async(db, version, date_from, date_to)
+
+@router.get("/activities/search")
+async def search(
+    q: Annotated[str, Query(min_length=1)],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)],
+    limit: Annotated[int, Query(ge=1, le=ACTIVITIES_MAX_PAGE_SIZE)] = ACTIVITIES_SEARCH_LIMIT
+) -> List[Activity]:
+    return await search_activities_async(db, q, limit)
+
+@router.get("/activity/{id}")
+async def get_activity(
+    id: Annotated[str, Path()],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)]
+) -> Activity:
+
+    if (activity := await get_activity_cached_async(db, id)) is None:
+        raise HTTPException(status_code=404)
+
+    return activity
+
+@router.post("/activity")
+async def create_activity(
+    body: Annotated[ActivityBase, Body()],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)],
+    idempotency_key: Annotated[str | None, Header(
+        max_length=255, 
+        description="Retries with the same key get the original response instead of creating another activity"
+    )] = None
+) -> DefaultResponseModel:
+    return await create_activity_idempotently(
+        body,
+        idempotency_key,
+        get_stored=lambda key: get_stored_response_async(db, key),
+        create=lambda activity, stored: create_activity_db_async(db, activity, stored),
+        rollback=db.rollback
+    )
+
+@router.patch("/activity/{id}")
+async def patch_activity(
+    id: Annotated[str, Path()],
+    body: Annotated[ActivityPatch, Body()],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)]
+) -> DefaultResponseModel:
+    
+    if await patch_activity_db_async(db, id, body) is None:
+        raise HTTPException(status_code=404)
+
+    return DefaultResponseModel(message="Patched")
+
+@router.delete("/activity/{id}")
+async def delete_activity(
+    id: Annotated[str, Path()],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)]
+) -> DefaultResponseModel:
+    
+    if not await delete_activity_db_async(db, id):
+        raise HTTPException(status_code=404)
+
+    return DefaultResponseModel(message="Patched")
+
+@router.post("/activities:batch")
+async def batch_activities(
+    body: Annotated[BatchRequest, Body()],
+    db: Annotated[AsyncSession, Depends(AsyncDBSessionProvider)]
+) -> BatchResponse:
+    """
+    Applies mixed create / patch / delete operations in one transaction,
+    `status` of each result is the status code the single operation endpoint would return
+    """
+
+    return BatchResponse(results=await apply_activity_batch_async(db, body.operations))
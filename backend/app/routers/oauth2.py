@@ -1,10 +1,11 @@
 from typing import Annotated
 from fastapi import APIRouter, Depends, Request, Response, status
 from sqlalchemy.orm import Session
-from app.dependencies import CreateExampleResponse, CreateRefreshResponses, DBSessionProvider, Example, ValidateCredentials, Tokens, EncodedTokens, retrieve_refresh_token, create_token, RefreshToken, DefaultResponseModel, Responses, CreateInternalErrorResponse, CreateAuthResponses
+from app.dependencies import Authorize, CreateAuthorizeResponses, CreateExampleResponse, CreateRefreshResponses, DBSessionProvider, Example, ValidateCredentials, Tokens, EncodedTokens, retrieve_refresh_token, create_token, RefreshToken, DefaultResponseModel, Responses, CreateInternalErrorResponse, CreateAuthResponses
 from app.config import ACCESS_TOKEN_EXPIRE_TIME, ENCRYPTION_ALGORITHM, REFRESH_TOKEN_EXPIRE_TIME, SECRET_KEY
-from app.domain.token_blacklist.service import create_blacklist_token, get_blacklist_token
+from app.domain.token_blacklist.service import create_blacklist_token, is_token_revoked, token_id
 from app.domain.token_blacklist.schemas import BlacklistTokenElement, BlacklistTokenElementFull
+from app.domain.user.service import revoke_user_tokens
 import datetime
 import jwt
 
@@ -63,15 +64,11 @@ async def logout(
     db: Annotated[Session, Depends(DBSessionProvider)]
 ) -> DefaultResponseModel:
     
-    if (access_token := request.cookies.get("access_token")):
-        if not get_blacklist_token(db, BlacklistTokenElement(token=access_token)):
-            decoded_at = jwt.decode(access_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
-            create_blacklist_token(db, BlacklistTokenElementFull(token=access_token, expiration_date=datetime.datetime.fromisoformat(decoded_at.get('expiration_date'))))
-    
-    if (refresh_token := request.cookies.get("refresh_token")):
-        if not get_blacklist_token(db, BlacklistTokenElement(token=refresh_token)):
-            decoded_rt = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
-            create_blacklist_token(db, BlacklistTokenElementFull(token=refresh_token, expiration_date=datetime.datetime.fromisoformat(decoded_rt.get('expiration_date'))))
+    for token in (request.cookies.get("access_token"), request.cookies.get("refresh_token")):
+        if token:
+            decoded = jwt.decode(token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
+            if not is_token_revoked(db, (id := token_id(token, decoded.get("jti")))):
+                create_blacklist_token(db, BlacklistTokenElementFull(id=id, expiration_date=datetime.datetime.fromisoformat(decoded.get('expiration_date'))))
 
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
@@ -79,6 +76,36 @@ async def logout(
     return DefaultResponseModel(message="Logged out")
     
 
+@router.delete(
+    "/tokens",
+    status_code=status.HTTP_200_OK,
+    responses=Responses(
+        CreateExampleResponse(
+            code=200, 
+            description="Successful Response", 
+            content_type="application/json", 
+            examples=[
+                Example(name="Logged out everywhere", summary="Logged out everywhere", description="Revoked every token issued to the user", value=DefaultResponseModel(message="Logged out everywhere")), 
+            ]
+        ),
+        CreateAuthorizeResponses()
+    )
+)
+async def logout_everywhere(
+    response: Response,
+    user_id: Annotated[int, Depends(Authorize)],
+    db: Annotated[Session, Depends(DBSessionProvider)]
+) -> DefaultResponseModel:
+    
+    # A single row update instead of blacklisting every token of every session
+    revoke_user_tokens(db, user_id)
+
+    response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token")
+
+    return DefaultResponseModel(message="Logged out everywhere")
+
+
 @router.patch(
     "/token", 
     status_code=status.HTTP_201_CREATED,
@@ -104,6 +131,7 @@ async def refresh_for_access_token(
         value=f"""{create_token(
             {
                 "user_id": refresh_token.user_id,
+                "token_version": refresh_token.token_version,
                 "token_type": "Bearer",
                 "type": "access",
                 "expiration_date": (datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_TIME)).isoformat()
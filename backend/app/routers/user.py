@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from app.dependencies import DefaultResponseModel, Authorize, DBSessionProvider, validate_password, CreateExampleResponse, Example, DefaultErrorModel, Responses, CreateAuthResponses, CreateAuthorizeResponses, CreateInternalErrorResponse
 from app.config import SECRET_KEY, ENCRYPTION_ALGORITHM, IP_ADDRESS, IMAGE_DIR, IMAGE_URL
 from app.domain.user.service import ( 
-    get_user_by_email, create_user, get_user
+    get_user_by_email, create_user, get_user, password_hasher
 )
 from app.domain.user.schemas import UserCreate, User
 from pydantic import BaseModel, Field
@@ -58,8 +58,11 @@ async def register_user(
             detail="Account with this email already exists"
         )
     
+    # Hashed in the process pool, not on the event loop
+    hashed_password = await password_hasher.hash_async(body.password)
+
     try:
-        create_user(db, body)
+        create_user(db, body, hashed_password)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
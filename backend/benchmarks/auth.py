@@ -0,0 +1,140 @@
+"""
+Compares the dependency chain of a protected route before and after `Authorize` became a single
+async dependency.
+
+The previous chain is `oauth2_scheme` -> `retrieve_access_token` -> `Authorize`, with a
+`DBSessionProvider` for both sync dependencies: every request decodes and verifies the JWT,
+parses its expiration date and makes two threadpool hops. The revocation set and the user cache
+are warm for both, so the numbers show the chain itself, not the database.
+
+Requests go through the ASGI app in-process (no network), `concurrency` of them at a time with
+the same cookie, like the burst of calls a page load makes.
+
+Usage (from the `backend` directory):
+
+```
+python benchmarks/auth.py [concurrency ...]
+```
+"""
+import os
+import sys
+import time
+import asyncio
+import datetime
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-" * 4)
+
+from typing import Annotated
+import httpx
+import jwt
+from fastapi import Depends, FastAPI, HTTPException, status
+from sqlalchemy.orm import Session
+from app.config import SECRET_KEY, ENCRYPTION_ALGORITHM
+from app.dependencies import AccessToken, Authorize, DBSessionProvider, Tokens, create_token, oauth2_scheme
+from app.domain.token_blacklist.service import is_token_revoked, revoked_tokens, token_id
+from app.domain.user.schemas import UserAuth
+from app.domain.user.service import get_user_auth, user_cache
+
+REQUESTS = 5000
+
+def legacy_retrieve_access_token(
+    token: Annotated[Tokens, Depends(oauth2_scheme)],
+    db: Annotated[Session, Depends(DBSessionProvider)]
+) -> AccessToken:
+    """
+    `retrieve_access_token` before the verified token cache
+    """
+    decoded_access_token = jwt.decode(token.access_token, SECRET_KEY, algorithms=[ENCRYPTION_ALGORITHM])
+
+    access_token = AccessToken(
+        jti=token_id(token.access_token, decoded_access_token.get("jti")),
+        user_id=decoded_access_token.get("user_id"),
+        token_version=decoded_access_token.get("token_version", 0),
+        type=decoded_access_token.get("type"),
+        token_type=decoded_access_token.get("token_type"),
+        expiration_date=decoded_access_token.get("expiration_date")
+    )
+
+    if datetime.datetime.now(datetime.UTC) > datetime.datetime.fromisoformat(access_token.expiration_date):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Outdated access_token')
+
+    return access_token
+
+def legacy_authorize(
+    access_token: Annotated[AccessToken, Depends(legacy_retrieve_access_token)],
+    db: Annotated[Session, Depends(DBSessionProvider)]
+) -> int:
+    """
+    `Authorize` before it was a single async dependency
+    """
+    if is_token_revoked(db, access_token.jti):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Blacklisted token')
+
+    if not (user := get_user_auth(db, access_token.user_id)) or access_token.token_version != user.token_version:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid credentials')
+
+    return access_token.user_id
+
+def prepare() -> tuple[FastAPI, str]:
+    app = FastAPI()
+
+    @app.get("/legacy")
+    async def legacy(user_id: Annotated[int, Depends(legacy_authorize)]) -> int:
+        return user_id
+
+    @app.get("/single")
+    async def single(user_id: Annotated[int, Depends(Authorize)]) -> int:
+        return user_id
+
+    # Warm revocation set and user cache, as in a running worker
+    revoked_tokens.loaded = True
+    user_cache.ttl = 3600
+    user_cache.set_local("user:1", UserAuth(id=1, is_active=True, token_version=0))
+
+    token = create_token({
+        "user_id": 1,
+        "token_version": 0,
+        "expiration_date": (datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours=1)).isoformat(),
+        "type": "access"
+    })
+    return app, token
+
+async def run(app: FastAPI, token: str, path: str, concurrency: int) -> dict:
+    latencies = []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", cookies={"access_token": token, "refresh_token": ""}) as client:
+        async def request():
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+
+        # Warm-up
+        await asyncio.gather(*(request() for _ in range(concurrency)))
+        latencies.clear()
+
+        start = time.perf_counter()
+        for _ in range(REQUESTS // concurrency):
+            await asyncio.gather(*(request() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "req/s": len(latencies) / elapsed,
+        "us/req": elapsed / len(latencies) * 1e6,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": statistics.quantiles(latencies, n=100)[98] * 1000
+    }
+
+if __name__ == "__main__":
+    app, token = prepare()
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 32]
+    columns = ["req/s", "us/req", "p50 ms", "p99 ms"]
+
+    print(f"{'concurrency':>12} {'chain':>8} " + " ".join(f"{column:>10}" for column in columns))
+    for concurrency in sizes:
+        for name in ("legacy", "single"):
+            results = asyncio.run(run(app, token, f"/{name}", concurrency))
+            print(f"{concurrency:>12} {name:>8} " + " ".join(f"{results[column]:>10.2f}" for column in columns))
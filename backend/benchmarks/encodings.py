@@ -0,0 +1,103 @@
+"""
+Compares the response encodings negotiated by `EncodingMiddleware` on a `GET /v1/activities` page:
+JSON and MessagePack, each as identity, gzip and brotli at a few levels.
+
+For every encoding it shows the bytes on the wire and the CPU spent on both ends, `encode` is what
+the server pays per response (MessagePack includes converting the JSON body), `decode` what the
+client pays. The levels in `app/config.py` are the ones marked with `*`.
+
+Usage (from the `backend` directory):
+
+```
+python benchmarks/encodings.py [rows ...]
+```
+"""
+import os
+import sys
+import time
+import gzip
+import uuid
+import datetime
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from app.config import COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+from app.encoding import brotli, msgpack
+
+def page(rows: int) -> bytes:
+    """
+    A list page the way `get_activities_page_json` encodes it
+    """
+    return orjson.dumps({
+        "items": [
+            {
+                "id": str(uuid.uuid4()),
+                "title": f"Activity {i}",
+                "notes": "testowanie monograficzne" if i % 2 else "",
+                "date": (datetime.datetime(2025, 1, 1) + datetime.timedelta(hours=i)).isoformat() if i % 3 else None,
+                "done": bool(i % 4 == 0)
+            }
+            for i in range(rows)
+        ],
+        "next_cursor": None
+    })
+
+def encodings() -> list[tuple[str, Callable, Callable]]:
+    """
+    (name, encode, decode) of every combination, encode takes the JSON body like the middleware does
+    """
+    representations = [("json", lambda body: body, orjson.loads)]
+    if msgpack is not None:
+        representations.append(("msgpack", lambda body: msgpack.packb(orjson.loads(body)), msgpack.unpackb))
+
+    codings = [("identity", lambda data: data, lambda data: data)]
+    for level in sorted({1, COMPRESSION_GZIP_LEVEL, 9}):
+        codings.append((
+            f"gzip-{level}" + ("*" if level == COMPRESSION_GZIP_LEVEL else ""),
+            lambda data, level=level: gzip.compress(data, compresslevel=level, mtime=0),
+            gzip.decompress
+        ))
+    if brotli is not None:
+        for quality in sorted({1, COMPRESSION_BROTLI_QUALITY, 11}):
+            codings.append((
+                f"br-{quality}" + ("*" if quality == COMPRESSION_BROTLI_QUALITY else ""),
+                lambda data, quality=quality: brotli.compress(data, quality=quality),
+                brotli.decompress
+            ))
+
+    return [
+        (f"{representation} {coding}", lambda body, r=r_encode, c=c_encode: c(r(body)), lambda data, r=r_decode, c=c_decode: r(c(data)))
+        for representation, r_encode, r_decode in representations
+        for coding, c_encode, c_decode in codings
+    ]
+
+def best_of(function, argument, repeat: int = 5) -> tuple[float, object]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 500]
+
+    if brotli is None or msgpack is None:
+        print("`brotli` or `msgpack` isn't installed, its encodings are skipped\n")
+
+    print(f"{'rows':>6} {'encoding':>18} {'bytes':>9} {'ratio':>7} {'encode ms':>10} {'decode ms':>10} {'MB/s enc':>9}")
+    for rows in sizes:
+        body = page(rows)
+        expected = orjson.loads(body)
+
+        for name, encode, decode in encodings():
+            encode_seconds, data = best_of(encode, body)
+            decode_seconds, decoded = best_of(decode, data)
+            assert decoded == expected, f"{name} doesn't round-trip"
+
+            print(
+                f"{rows:>6} {name:>18} {len(data):>9} {len(body) / len(data):>6.1f}x "
+                f"{encode_seconds * 1000:>10.2f} {decode_seconds * 1000:>10.2f} {len(body) / encode_seconds / 1e6:>9.0f}"
+            )
@@ -0,0 +1,92 @@
+"""
+Compares the regular and the fast (`FAST_SERIALIZATION`) path of `GET /v1/activities`.
+
+The regular path loads ORM instances, validates them into `ActivityPage` and encodes the result
+the way FastAPI does, the fast path is `get_activities_page_json`. Both run against an in-memory
+SQLite database, so the numbers show the Python side of the work, not the network or Postgres.
+
+Usage (from the `backend` directory):
+
+```
+python benchmarks/serialization.py [rows ...]
+```
+"""
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from app.domain.activity import schemas
+from app.domain.activity.service import get_activities_page, get_activities_page_json
+
+page_adapter = TypeAdapter(schemas.ActivityPage)
+
+def regular(db, rows: int) -> bytes:
+    page = get_activities_page(db, rows)
+    return JSONResponse(page_adapter.dump_python(page_adapter.validate_python(page, from_attributes=True), mode="json")).body
+
+def fast(db, rows: int) -> bytes:
+    return get_activities_page_json(db, rows)
+
+def prepare(rows: int):
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        # Columns the ORM loads, the model itself can't be created in SQLite (tsvector, GIN indexes)
+        connection.execute(text(
+            "CREATE TABLE activities (id VARCHAR PRIMARY KEY, title VARCHAR, notes VARCHAR, date DATETIME, done BOOLEAN, "
+            "revision BIGINT NOT NULL DEFAULT 0, updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        connection.execute(
+            text("INSERT INTO activities (id, title, notes, date, done) VALUES (:id, :title, :notes, :date, :done)"),
+            [
+                {
+                    "id": str(uuid.uuid4()),
+                    "title": f"Activity {i}",
+                    "notes": "testowanie monograficzne" if i % 2 else "",
+                    "date": datetime.datetime(2025, 1, 1) + datetime.timedelta(hours=i) if i % 3 else None,
+                    "done": bool(i % 4 == 0)
+                }
+                for i in range(rows)
+            ]
+        )
+    return sessionmaker(bind=engine)
+
+def measure(path, Session, rows: int, repeat: int = 3) -> tuple[float, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        with Session() as db:
+            start = time.perf_counter()
+            path(db, rows)
+            best = min(best, time.perf_counter() - start)
+
+    with Session() as db:
+        tracemalloc.start()
+        path(db, rows)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return best, peak
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+
+    print(f"{'rows':>8} {'path':>8} {'total ms':>10} {'us/row':>8} {'peak MiB':>9} {'bytes/row':>10}")
+    for rows in sizes:
+        Session = prepare(rows)
+
+        with Session() as db:
+            assert regular(db, rows) == fast(db, rows), "fast path output differs"
+
+        results = {name: measure(path, Session, rows) for name, path in (("regular", regular), ("fast", fast))}
+        for name, (seconds, peak) in results.items():
+            print(f"{rows:>8} {name:>8} {seconds * 1000:>10.1f} {seconds / rows * 1e6:>8.2f} {peak / 2**20:>9.1f} {peak / rows:>10.0f}")
+
+        print(f"{rows:>8} {'speedup':>8} {results['regular'][0] / results['fast'][0]:>10.1f}x {'':>8} {results['regular'][1] / results['fast'][1]:>9.1f}x")
@@ -0,0 +1,46 @@
+"""
+Picks the bcrypt cost for this host: the highest one whose hash still fits the latency budget.
+
+Every cost doubles the work of the previous one, so they are measured upwards until the budget
+is exceeded. Set the result as `PASSWORD_HASH_ROUNDS`, stored hashes of another cost are
+rehashed on their users' next login.
+
+```
+python calibrate.py [--target-ms 250] [--samples 5]
+```
+"""
+from app.config import PASSWORD_HASH_ROUNDS, PASSWORD_HASH_TARGET_MS
+from app.hashing import password_context
+from cli import option
+from passlib.hash import bcrypt
+import statistics
+import time
+
+def measure(rounds: int, samples: int) -> float:
+    """
+    Median time of a single hash at `rounds`, in milliseconds
+    """
+    context = password_context(rounds)
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration password")
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+
+    target = float(option("--target-ms", str(PASSWORD_HASH_TARGET_MS)))
+    samples = int(option("--samples", "5"))
+    chosen = bcrypt.min_rounds
+
+    print(f"{'rounds':>8} {'ms':>10}")
+    for rounds in range(bcrypt.min_rounds, bcrypt.max_rounds + 1):
+        ms = measure(rounds, samples)
+        print(f"{rounds:>8} {ms:>10.1f}" + ("  (current)" if rounds == PASSWORD_HASH_ROUNDS else ""))
+        if ms > target:
+            break
+        chosen = rounds
+
+    print(f"\nHighest cost within {target:.0f} ms: {chosen}")
+    print(f"PASSWORD_HASH_ROUNDS={chosen}")
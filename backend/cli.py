@@ -0,0 +1,17 @@
+"""
+Argument parsing shared by the command line scripts (`loader.py`, `calibrate.py`)
+"""
+import sys
+
+def option(name: str, default: str) -> str:
+    """
+    Value following `name` in the arguments, `default` when it isn't given
+    """
+    if name not in sys.argv:
+        return default
+
+    try:
+        return sys.argv[sys.argv.index(name) + 1]
+    except IndexError:
+        print(f"Argument {name} requires a value")
+        exit(1)
@@ -0,0 +1,114 @@
+"""
+Bulk import and export of activities through PostgreSQL `COPY`.
+
+Files are JSON arrays in the shape of `frontend/data/activities.json`, or NDJSON (one activity
+per line) when the name ends with `.ndjson` / `.jsonl`. Both directions stream, a file is never
+loaded into memory as a whole. Activities without an `id` get a new one, existing ids are skipped.
+
+```
+python loader.py import activities.json [--chunk-size 10000]
+python loader.py export activities.ndjson [--format json|ndjson|csv]
+```
+"""
+from typing import BinaryIO, Iterator, TextIO
+from uuid import uuid4
+from app.database import SessionLocal
+from app.config import ACTIVITIES_IMPORT_CHUNK_SIZE
+from app.domain.activity import schemas
+from app.domain.activity.service import copy_activities_in, copy_activities_out
+from cli import option
+import json
+import sys
+import time
+
+def iter_json_array(file: TextIO, read_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Yields the elements of a top-level JSON array, reading `file` in blocks of `read_size` characters
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(read_size).lstrip()
+
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    buffer = buffer[1:]
+
+    while True:
+        buffer = buffer.lstrip().removeprefix(",").lstrip()
+        if buffer.startswith("]"):
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The element continues in the next block
+            if not (block := file.read(read_size)):
+                raise
+            buffer += block
+            continue
+
+        yield element
+        buffer = buffer[end:]
+
+def iter_ndjson(file: TextIO) -> Iterator[dict]:
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+def read_activities(file: TextIO, ndjson: bool) -> Iterator[schemas.Activity]:
+    for element in iter_ndjson(file) if ndjson else iter_json_array(file):
+        yield schemas.Activity.model_validate({"id": str(uuid4()), **element})
+
+class JsonArrayWriter:
+    """
+    Turns the NDJSON written by `copy_activities_out` into a JSON array on the fly
+    """
+
+    def __init__(self, out: BinaryIO):
+        self.out = out
+        self.pending_newline = False
+        self.out.write(b"[\n")
+
+    def write(self, data: bytes) -> None:
+        # The newline ending a block is held back, the last one must not be followed by a comma
+        if self.pending_newline:
+            self.out.write(b",\n")
+        self.pending_newline = data.endswith(b"\n")
+        self.out.write((data[:-1] if self.pending_newline else data).replace(b"\n", b",\n"))
+
+    def close(self) -> None:
+        self.out.write(b"\n]\n" if self.pending_newline else b"]\n")
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("import", "export"):
+        print(__doc__)
+        exit(1)
+
+    command, path = sys.argv[1], sys.argv[2]
+    ndjson = path.endswith((".ndjson", ".jsonl"))
+    start = time.perf_counter()
+
+    if command == "import":
+        chunk_size = int(option("--chunk-size", str(ACTIVITIES_IMPORT_CHUNK_SIZE)))
+
+        with open(path, encoding="utf-8") as file, SessionLocal() as db:
+            inserted = copy_activities_in(db, read_activities(file, ndjson), chunk_size)
+
+        print(f"Imported {inserted} activities in {time.perf_counter() - start:.1f}s")
+
+    else:
+        format = option("--format", "ndjson" if ndjson else "csv" if path.endswith(".csv") else "json")
+
+        if format not in ("json", "ndjson", "csv"):
+            print("Argument --format has to be one of json, ndjson, csv")
+            exit(1)
+
+        with open(path, "wb") as file, SessionLocal() as db:
+            if format == "json":
+                writer = JsonArrayWriter(file)
+                copy_activities_out(db, writer, "ndjson")
+                writer.close()
+            else:
+                copy_activities_out(db, file, format)
+
+        print(f"Exported activities to {path} in {time.perf_counter() - start:.1f}s")
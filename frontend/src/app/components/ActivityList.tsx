@@ -12,10 +12,23 @@ export type Activity = {
   done: boolean;
 };
 
+type ActivityPage = {
+  items: Activity[];
+  next_cursor: string | null;
+};
+
 export async function listActivities(opts?: { signal?: AbortSignal }): Promise<Activity[]> {
-  const res = await fetch(`${BASE_URL}/v1/activities`, { method: "GET", signal: opts?.signal });
-  if (!res.ok) throw new ApiError("Nie udało się pobrać listy aktywności.", res.status);
-  return res.json();
+  const items: Activity[] = [];
+  let cursor: string | null = null;
+  do {
+    const query: string = cursor ? `?after=${encodeURIComponent(cursor)}` : "";
+    const res = await fetch(`${BASE_URL}/v1/activities${query}`, { method: "GET", signal: opts?.signal });
+    if (!res.ok) throw new ApiError("Nie udało się pobrać listy aktywności.", res.status);
+    const page: ActivityPage = await res.json();
+    items.push(...page.items);
+    cursor = page.next_cursor;
+  } while (cursor);
+  return items;
 }
 
 